@@ -1,8 +1,11 @@
 from modules.utils import logger
 from modules.YfScrapper import *
 from modules.Forecaster import *
+from modules.downsample import downsample
 import streamlit as st
 
+CHART_WIDTH = 800 # Pixel width of the charts, series are downsampled to at most this many points
+
 @st.cache_resource
 def initialize(name: str):
     if name not in st.session_state:
@@ -14,6 +17,20 @@ def initialize(name: str):
         logger.info(f'{instance} initiated')
     return instance
 
+@st.cache_data(max_entries=512)
+def chart_data(_fc: Forecaster, ticker: str, version: int, width: int, kind: str):
+    '''
+    Downsampled chart data, cached per (ticker, series version, pixel width) so reruns send a bounded payload
+    Parameters:
+        _fc (Forecaster) : forecaster holding the series, not hashed by streamlit
+        ticker (str) : ticker to chart
+        version (int) : version of the ticker results in the forecaster
+        width (int) : pixel width of the chart
+        kind (str) : 'forecast' for the forecast with its confidence interval or 'ts' for the past prices
+    '''
+    data = _fc.store[ticker] if kind == 'forecast' else _fc[ticker]['ts']
+    return downsample(data.to_timestamp(), width)
+
 def main():
     st.set_page_config(page_title='Financial Analysis by Sien Long')
     fc = initialize('Forecaster')
@@ -41,11 +58,11 @@ def main():
     if submitted and len(ticker)>0:
         with st.spinner('Forecasting ...'):
             fc.forecast(ticker, price_type=price_type, period=period, order=(p,d,q))
-        st.line_chart(fc[ticker]['forecast'].to_timestamp())
+        st.line_chart(chart_data(fc, ticker, fc.versions[ticker], CHART_WIDTH, 'forecast'))
         if st.button('View model stats'):
             st.write(fc[ticker]['model'].summary())
         if st.button('Past price'):
-            st.line_chart(fc[ticker]['ts'].to_timestamp())
+            st.line_chart(chart_data(fc, ticker, fc.versions[ticker], CHART_WIDTH, 'ts'))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,208 @@
+'''
+Offline benchmarks of the forecasting and scraping hot paths.
+No network is used: statistics pages are served from benchmarks/fixtures/html,
+universes are built from the committed data/*.csv snapshots and prices are synthetic.
+Unless saved yahoo pages are dropped into the fixtures, the pages are small synthetic renderings of the snapshot,
+so the get_ticker_stats throughput does not represent the parse cost of real pages.
+
+Usage (from the repository root):
+    python -m benchmarks.bench
+    python -m benchmarks.bench --sizes 1 40 500 --output bench.json
+    python -m benchmarks.bench --compare bench.json
+'''
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tracemalloc
+import warnings
+os.makedirs('logs', exist_ok=True)
+
+from sklearn import preprocessing
+from sklearn.cluster import KMeans
+from modules.utils import logger
+from modules.Forecaster import Forecaster
+from modules.YfScrapper import YfScrapper
+from benchmarks.fixtures import load_universe, load_html_fixtures, is_rendered, synthetic_prices, synthetic_forecast
+
+SIZES = [1, 40, 500, 5000]
+FEATURES = ['Market Cap (B)', 'Revenue (ttm) (B)', 'Profit Margin (%)','Quarterly Earnings Growth (yoy) (%)', '52 Week Change (%)']
+
+class OfflineScrapper(YfScrapper):
+    '''
+    YfScrapper serving statistics pages from memory
+    '''
+    def __init__(self, pages: dict):
+        super().__init__()
+        self.pages = pages
+
+    def _fetch_page(self, url: str) -> str:
+        return self.pages[url.rsplit('=', 1)[-1]]
+
+class OfflineForecaster(Forecaster):
+    '''
+    Forecaster using synthetic weekly price histories
+    '''
+    def _history(self, ticker: str, period: str, interval: str):
+        return synthetic_prices(ticker)
+
+def measure(func, repeat: int = 1) -> tuple:
+    '''
+    Times a function (best of repeat) and measures its peak traced memory in a separate run,
+    so that the tracing overhead does not affect the timing
+    Returns:
+        (seconds, peak memory in MB)
+    '''
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1e6
+
+def bench_scrapper(size: int) -> dict:
+    '''
+    Benchmarks get_ticker_stats parsing, clean_df and compile_dataframes for a universe
+    '''
+    tickers = load_universe(size).index.to_list()
+    scrapper = OfflineScrapper(load_html_fixtures(tickers))
+    rendered = sum(is_rendered(html) for html in scrapper.pages.values())
+    if rendered:
+        print(f'NOTE: {rendered} of {len(tickers)} statistics pages are synthetic ({size} tickers), '
+              f'get_ticker_stats does not measure the parsing of real pages', flush=True)
+    raw = {ticker: scrapper._parse_stats_page(ticker, scrapper.pages[ticker], clean_df=False) for ticker in tickers}
+
+    def clean():
+        for df in raw.values():
+            scrapper.clean_df(df.copy())
+
+    def compile():
+        scrapper.tickers = {ticker: df for ticker, df in cleaned.items()}
+        scrapper.compile_dataframes()
+
+    cleaned = {ticker: scrapper.clean_df(df.copy()) for ticker, df in raw.items()}
+    return {
+        'get_ticker_stats': lambda: scrapper.get_ticker_stats(tickers, clean_df=True),
+        'clean_df': clean,
+        'compile_dataframes': compile,
+    }
+
+def bench_forecaster(size: int, max_fits: int) -> dict:
+    '''
+    Benchmarks SARIMA fitting, validation and the trade rules for a universe.
+    Fits are capped to max_fits tickers as each seasonal fit takes seconds
+    '''
+    tickers = load_universe(size).index.to_list()
+    fit_tickers = tickers[:max_fits]
+    fc = OfflineForecaster()
+    fc.tickers = {ticker: {'forecast': synthetic_forecast(ticker)} for ticker in tickers}
+
+    def validate():
+        for ticker in fit_tickers:
+            fc.forecast_validation(ticker, plot=False)
+
+    def screen():
+        # Baselines are often flat or monotone, the rules must handle forecasts without trades
+        screened = OfflineForecaster(*tickers)
+        screened.screen_forecast(escalate=False)
+        screened.find_max_profit()
+        screened.find_best_trades()
+
+    return {
+        'forecast': (lambda: OfflineForecaster().forecast(*fit_tickers), len(fit_tickers)),
+        'forecast_validation': (validate, len(fit_tickers)),
+        'find_max_profit': lambda: fc.find_max_profit(*tickers),
+        'find_best_trades': lambda: fc.find_best_trades(*tickers),
+        'screen_forecast': screen,
+    }
+
+def bench_segmentation(size: int) -> dict:
+    '''
+    Benchmarks the K-means segmentation of p3_segment_analysis on a universe
+    '''
+    X = load_universe(size).loc[:, FEATURES].fillna(0)
+
+    def segment():
+        scaler = preprocessing.MinMaxScaler()
+        model = KMeans(random_state=42, init='k-means++', n_clusters=min(8, len(X)))
+        model.fit(scaler.fit_transform(X))
+
+    return {'kmeans': segment}
+
+def run(sizes: list, max_fits: int, repeat: int, only: list = None) -> list:
+    '''
+    Runs every benchmark for every universe size
+    Returns:
+        list of result dictionaries
+    '''
+    results = []
+    measured = set()
+    for size in sizes:
+        cases = {**bench_scrapper(size), **bench_forecaster(size, max_fits), **bench_segmentation(size)}
+        for name, case in cases.items():
+            func, n = case if isinstance(case, tuple) else (case, size)
+            # Capped benchmarks would repeat the same work for larger universes
+            if (name, n) in measured or (only and name not in only):
+                continue
+            measured.add((name, n))
+            seconds, peak_mb = measure(func, repeat)
+            result = dict(benchmark=name, size=size, n=n, seconds=round(seconds, 4),
+                          throughput=round(n / seconds, 2), peak_mb=round(peak_mb, 2))
+            print(f"{name:<22}{size:>6}{n:>6}{seconds:>12.4f}s{result['throughput']:>14.2f}/s{peak_mb:>12.2f}MB", flush=True)
+            results.append(result)
+    return results
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    '''
+    Compares results against a saved run
+    Returns:
+        list of regression messages, throughput lower or peak memory higher than tolerance
+    '''
+    with open(baseline_path) as f:
+        baseline = {(r['benchmark'], r['n']): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        base = baseline.get((result['benchmark'], result['n']))
+        if not base:
+            continue
+        if result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{result['benchmark']} (n={result['n']}) throughput {base['throughput']} -> {result['throughput']}/s")
+        if result['peak_mb'] > base['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{result['benchmark']} (n={result['n']}) peak memory {base['peak_mb']} -> {result['peak_mb']}MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the forecasting and scraping hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='universe sizes (number of tickers)')
+    parser.add_argument('--max-fits', type=int, default=3, help='maximum number of SARIMA fits per benchmark')
+    parser.add_argument('--repeat', type=int, default=1, help='timing runs, the best is reported')
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run')
+    parser.add_argument('--output', help='json file to save the results')
+    parser.add_argument('--compare', help='json file of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    warnings.filterwarnings('ignore')
+    print(f"{'benchmark':<22}{'size':>6}{'n':>6}{'time':>13}{'throughput':>16}{'peak memory':>14}")
+    results = run(args.sizes, args.max_fits, args.repeat, args.only)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import os
+from datetime import datetime
+from itertools import product
+from string import ascii_uppercase
+import numpy as np
+import pandas as pd
+from modules.YfScrapper import YfScrapper
+
+SNAPSHOT = 'data/s&p_2023-04-16.csv'
+HTML_DIR = 'benchmarks/fixtures/html'
+RENDERED_MARKER = '<!-- rendered from snapshot -->'
+DATE_COLUMNS = ['Dividend Date', 'Ex-Dividend Date', 'Last Split Date', 'Fiscal Year Ends', 'Most Recent Quarter (mrq)']
+
+def load_universe(size: int, filepath: str = SNAPSHOT, seed: int = 42) -> pd.DataFrame:
+    '''
+    Builds a statistics universe of the requested size from a committed snapshot.
+    Real constituents are used first, further rows are resampled from the snapshot with
+    multiplicative jitter on the numerical columns and given synthetic 4 letter tickers
+    Parameters:
+        size (int) : number of tickers in the universe
+        filepath (str) : snapshot csv to sample from
+        seed (int) : seed of the random generator
+    Returns:
+        pd.DataFrame indexed by ticker
+    '''
+    df = pd.read_csv(filepath, index_col=0)
+    df.columns = [col.strip() for col in df.columns]
+    df = df.set_index('Ticker')
+    if size <= len(df):
+        return df.iloc[:size].copy()
+
+    rng = np.random.default_rng(seed)
+    extra = df.iloc[rng.integers(0, len(df), size - len(df))].copy()
+    numeric = extra.select_dtypes('number').columns
+    extra[numeric] = extra[numeric] * rng.lognormal(0, 0.1, (len(extra), len(numeric)))
+    extra.index = synthetic_tickers(len(extra))
+    return pd.concat([df, extra])
+
+def synthetic_tickers(n: int) -> list:
+    '''
+    Generates n unique tickers starting with Z, which are not used by the S&P constituents
+    '''
+    return ['Z' + ''.join(letters) for letters in product(ascii_uppercase, repeat=3)][:n]
+
+def _format_value(col: str, value) -> str:
+    '''
+    Formats a cleaned snapshot value back into the string shown on the yahoo statistics page
+    '''
+    if col in DATE_COLUMNS:
+        if pd.isna(value):
+            return ''
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%b %d, %Y')
+    if pd.isna(value):
+        return 'N/A'
+    if col == 'Last Split Factor (x:1)':
+        return f'{max(int(value), 1)}:1'
+    if '(B)' in col:
+        return f'{value:,.2f}B'
+    if '(%)' in col:
+        return f'{value:.2f}%'
+    return f'{value:.2f}'
+
+def build_stats_page(ticker: str, row: pd.Series, mapping_dict: dict) -> str:
+    '''
+    Renders a statistics row as html in the layout of the yahoo statistics page,
+    i.e. a h1 title followed by tables of (metric, value) rows.
+    The page is synthetic, a few KB against the hundreds of KB of markup of a real page,
+    so it exercises the parsing logic but not the cost of parsing real pages
+    Parameters:
+        ticker (str) : ticker of the page
+        row (pd.Series) : cleaned statistics of the ticker
+        mapping_dict (dict) : YfScrapper mapping of yahoo metrics to column names
+    Returns:
+        html string
+    '''
+    reverse_mapping = {v: k for k, v in mapping_dict.items()}
+    rows = []
+    for col, value in row.items():
+        if col == 'Shares Short (M)':
+            label = 'Shares Short (Mar 30, 2023) 4'
+        elif col == 'Shares Short':
+            label = 'Shares Short (prior month Feb 27, 2023) 4'
+        else:
+            label = reverse_mapping.get(col, col)
+        rows.append(f'<tr><td>{label}</td><td>{_format_value(col, value)}</td></tr>')
+
+    tables = ''.join(f'<table><tbody>{"".join(rows[i:i+10])}</tbody></table>' for i in range(0, len(rows), 10))
+    return f'<html><body>{RENDERED_MARKER}<h1>{ticker} Inc. ({ticker})</h1>{tables}</body></html>'
+
+def load_html_fixtures(tickers: list, html_dir: str = HTML_DIR) -> dict:
+    '''
+    Loads the saved statistics pages of the tickers, pages are rendered from the snapshot
+    and saved into html_dir the first time they are requested.
+    Pages saved from yahoo itself can be dropped into html_dir as {ticker}.html to be used instead
+    Parameters:
+        tickers (list) : tickers of the universe
+        html_dir (str) : directory of saved pages
+    Returns:
+        dictionary of ticker -> html
+    '''
+    os.makedirs(html_dir, exist_ok=True)
+    mapping_dict = YfScrapper().mapping_dict
+    universe = None
+    pages = {}
+    for ticker in tickers:
+        filepath = os.path.join(html_dir, f'{ticker}.html')
+        if not os.path.exists(filepath):
+            if universe is None:
+                universe = load_universe(len(tickers))
+            with open(filepath, 'w') as f:
+                f.write(build_stats_page(ticker, universe.loc[ticker], mapping_dict))
+        with open(filepath) as f:
+            pages[ticker] = f.read()
+    return pages
+
+def is_rendered(html: str) -> bool:
+    '''
+    Returns:
+        whether a fixture page was rendered from the snapshot rather than saved from yahoo
+    '''
+    return RENDERED_MARKER in html
+
+def synthetic_prices(ticker: str, periods: int = 261, freq: str = 'W-MON', end: str = '2023-04-10') -> pd.DataFrame:
+    '''
+    Generates a reproducible price history in the format returned by yf.Ticker.history,
+    a geometric random walk with a yearly seasonal component, seeded by the ticker
+    Parameters:
+        ticker (str) : ticker used to seed the series
+        periods (int) : length of the series
+        freq (str) : pandas frequency of the index
+        end (str) : last date of the series
+    Returns:
+        pd.DataFrame with 'Open', 'High', 'Low', 'Close', 'Volume' columns
+    '''
+    rng = np.random.default_rng(sum(ord(c) * 31**i for i, c in enumerate(ticker)))
+    index = pd.date_range(end=end, periods=periods, freq=freq)
+    season = 0.05 * np.sin(2 * np.pi * index.dayofyear.to_numpy() / 365.25 + rng.uniform(0, 2*np.pi))
+    close = rng.uniform(20, 500) * np.exp(np.cumsum(rng.normal(0.001, 0.03, periods)) + season)
+    spread = np.abs(rng.normal(0, 0.01, periods)) * close
+    return pd.DataFrame({
+        'Open': close * (1 + rng.normal(0, 0.005, periods)),
+        'High': close + spread,
+        'Low': close - spread,
+        'Close': close,
+        'Volume': rng.integers(1e5, 1e7, periods),
+    }, index=index)
+
+def synthetic_forecast(ticker: str, periods: int = 53, end: str = '2024-04-08') -> pd.Series:
+    '''
+    Generates a weekly forecast series in the format stored by Forecaster.forecast
+    '''
+    ts = synthetic_prices(ticker, periods=periods, end=end)['Close'].to_period('W')
+    ts.name = 'predicted_mean'
+    return ts
+
+if __name__ == '__main__':
+    # Renders the statistics pages of the full snapshot into the fixture directory
+    universe = load_universe(len(pd.read_csv(SNAPSHOT)))
+    load_html_fixtures(universe.index.to_list())
+    print(f'Saved {len(universe)} pages into {HTML_DIR}')
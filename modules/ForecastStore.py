@@ -0,0 +1,159 @@
+from typing import Any
+import pandas as pd
+import numpy as np
+
+class ForecastStore():
+    '''
+    Array backed storage of compact forecast results, one row per ticker.
+    Keeps only the fitted parameters, the forecast and its confidence interval, so that results of large
+    universes can stay in memory without the data, state space matrices and covariances of the fitted models
+    '''
+    def __init__(self, horizon: int = 53, n_params: int = 8, capacity: int = 16) -> None:
+        '''
+        Preallocates the arrays, they are grown when more tickers, steps or parameters are stored
+        Parameters:
+            horizon (int) : initial number of forecast steps
+            n_params (int) : initial number of model parameters
+            capacity (int) : initial number of tickers
+        '''
+        self.index = {}
+        self.values = np.full((capacity, horizon, 3), np.nan) # [mean, lower, upper] per step
+        self.params = np.full((capacity, n_params), np.nan)
+        self.steps = np.zeros(capacity, dtype=np.int32)
+        self.starts = np.zeros(capacity, dtype=np.int64) # Period ordinal of the first forecast step
+        self.meta = []
+
+    def __repr__(self) -> str:
+        return f'ForecastStore(tickers={len(self)}, horizon={self.values.shape[1]}, nbytes={self.nbytes})'
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self.index
+
+    def __getitem__(self, ticker: str) -> pd.DataFrame:
+        '''
+        Returns:
+            pd.DataFrame of 'mean', 'lower', 'upper' with the forecast periods as index
+        '''
+        row = self.index[ticker]
+        return pd.DataFrame(self.values[row, :self.steps[row]], index=self._periods(row), columns=['mean', 'lower', 'upper'])
+
+    @property
+    def tickers(self) -> list:
+        return list(self.index)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.params.nbytes + self.steps.nbytes + self.starts.nbytes
+
+    def put(self, ticker: str, forecast: pd.Series, conf_int: Any, params: Any, **meta) -> None:
+        '''
+        Stores the results of a ticker, overwriting any previous results
+        Parameters:
+            ticker (str) : ticker of the results
+            forecast (pd.Series) : point forecast with a period index
+            conf_int (pd.DataFrame or np.ndarray) : lower and upper bounds of every step
+            params (pd.Series or np.ndarray) : fitted model parameters
+            **meta : information required to rehydrate the model, e.g. order, seasonal_order, end
+        '''
+        steps, n_params = len(forecast), len(params)
+        meta = {**meta, 'freq': forecast.index.freqstr, 'n_params': n_params}
+        ordinals = forecast.index.asi8
+        if steps and ordinals[-1] - ordinals[0] + 1 != steps: # e.g. daily forecasts skipping weekends
+            meta['ordinals'] = ordinals.tolist()
+        if ticker in self.index:
+            row = self.index[ticker]
+            self.meta[row] = meta
+        else:
+            row = len(self.index)
+            self.index[ticker] = row
+            self.meta.append(meta)
+        self._reserve(row+1, steps, n_params)
+
+        self.values[row] = np.nan
+        self.values[row, :steps, 0] = np.asarray(forecast)
+        self.values[row, :steps, 1:] = np.asarray(conf_int)
+        self.params[row] = np.nan
+        self.params[row, :n_params] = np.asarray(params)
+        self.steps[row] = steps
+        self.starts[row] = forecast.index[0].ordinal
+
+    def remove(self, ticker: str) -> None:
+        '''
+        Removes the results of a ticker, the last row is moved into its place
+        '''
+        row = self.index.pop(ticker)
+        last = len(self.index)
+        if row != last:
+            moved = next(t for t, r in self.index.items() if r == last)
+            self.index[moved] = row
+            self.values[row], self.params[row] = self.values[last], self.params[last]
+            self.steps[row], self.starts[row] = self.steps[last], self.starts[last]
+            self.meta[row] = self.meta[last]
+        self.meta.pop()
+        self.values[last], self.params[last] = np.nan, np.nan
+        self.steps[last], self.starts[last] = 0, 0
+
+    def forecast(self, ticker: str) -> pd.Series:
+        '''
+        Returns:
+            point forecast of a ticker, in the same format as the forecasts from model_fit.predict
+        '''
+        row = self.index[ticker]
+        return pd.Series(self.values[row, :self.steps[row], 0], index=self._periods(row), name='predicted_mean')
+
+    def conf_int(self, ticker: str) -> pd.DataFrame:
+        '''
+        Returns:
+            pd.DataFrame of the 'lower' and 'upper' bounds of a ticker
+        '''
+        return self[ticker][['lower', 'upper']]
+
+    def interval_width(self, tickers: list = None, relative: bool = True) -> np.ndarray:
+        '''
+        Computes the width of the confidence interval of every step for many tickers at once
+        Parameters:
+            tickers (list) : tickers to compute, if None uses every stored ticker
+            relative (bool) : whether to divide the width by the point forecast
+        Returns:
+            np.ndarray of shape (tickers, horizon), NaN beyond the steps of a ticker
+        '''
+        rows = np.arange(len(self)) if tickers is None else np.array([self.index[ticker] for ticker in tickers], dtype=int)
+        values = self.values[rows]
+        width = values[..., 2] - values[..., 1]
+        if relative:
+            width = width / np.abs(values[..., 0])
+        return width
+
+    def get_params(self, ticker: str) -> np.ndarray:
+        row = self.index[ticker]
+        return self.params[row, :self.meta[row]['n_params']]
+
+    def _periods(self, row: int) -> pd.PeriodIndex:
+        freq = self.meta[row]['freq']
+        if 'ordinals' in self.meta[row]:
+            return pd.PeriodIndex.from_ordinals(self.meta[row]['ordinals'], freq=freq)
+        return pd.period_range(start=pd.Period(ordinal=int(self.starts[row]), freq=freq), periods=int(self.steps[row]), freq=freq)
+
+    def _reserve(self, rows: int, steps: int, n_params: int) -> None:
+        '''
+        Grows the arrays (doubling the rows) to fit the required rows, steps and parameters
+        '''
+        capacity, horizon, _ = self.values.shape
+        if rows <= capacity and steps <= horizon and n_params <= self.params.shape[1]:
+            return
+        capacity = max(capacity, 1)
+        while capacity < rows:
+            capacity *= 2
+        horizon = max(horizon, steps)
+        n_params = max(self.params.shape[1], n_params)
+
+        values = np.full((capacity, horizon, 3), np.nan)
+        values[:self.values.shape[0], :self.values.shape[1]] = self.values
+        params = np.full((capacity, n_params), np.nan)
+        params[:self.params.shape[0], :self.params.shape[1]] = self.params
+        self.values, self.params = values, params
+        self.steps = np.concatenate([self.steps, np.zeros(capacity-len(self.steps), dtype=np.int32)])
+        self.starts = np.concatenate([self.starts, np.zeros(capacity-len(self.starts), dtype=np.int64)])
@@ -1,11 +1,33 @@
 from typing import Any, Iterable
+from collections import OrderedDict
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor
 import yfinance as yf
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
 from statsmodels.tsa.arima.model import ARIMA
+from modules.ForecastStore import ForecastStore
+from modules.SharedPanel import SharedPanel
+from modules.dataset import DATASET_ROOT, forecasts_table, write_dataset
+from modules.baselines import baseline_forecast, METHODS
+from modules.charts import draw_forecast, draw_validation, render_chart_pack, FIGSIZE
 from modules.utils import logger
 
+# Period frequency of each supported interval, and the seasonal period used for it in forecast_multi
+PERIOD_FREQUENCIES = {'1d': 'D', '1wk': 'W', '1mo': 'M'}
+SEASONAL_PERIODS = {'1d': 5, '1wk': 52, '1mo': 12}
+# How daily bars are aggregated into longer intervals for each price type
+PRICE_AGGREGATIONS = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last'}
+
+def forecast_periods(last: pd.Period, steps: int) -> pd.PeriodIndex:
+    '''
+    Periods following the last period of a price history, daily periods skip the weekends as prices do
+    '''
+    if last.freqstr == 'D':
+        return pd.bdate_range(start=(last + 1).to_timestamp(), periods=steps).to_period('D')
+    return pd.period_range(start=last + 1, periods=steps, freq=last.freq)
+
 class Forecaster():
     '''
     Object class to retrieve prices, forecast, and determine buy/sell actions
@@ -17,9 +39,12 @@ class Forecaster():
             tickers (str) : tickers to store
             price_type (str) : type of price during the interval 'Open', 'Close', 'High', 'Low'
             period (str) : length of time series - '5y', '1y', 'ytd', '10y'
-            interval (str) : Interval of prices - '1wk', '1d'
+            interval (str) : Interval of prices - '1wk', '1d', '1mo'
             order (tuple) : (p, d, q)
             seasonal_order (tuple) : (P, D, Q, m)
+            compact (bool) : whether to keep only the parameters, forecast and confidence interval of fits in self.store
+            alpha (float) : significance level of the confidence intervals
+            history_cache_size (int) : number of daily price histories kept for forecast_multi, least recently used are dropped
         '''
         self.tickers = {}
         for arg in args:
@@ -33,6 +58,13 @@ class Forecaster():
         self.interval = kwargs.get("interval", '1wk')
         self.order = kwargs.get("order", (0, 1, 1))
         self.seasonal_order = kwargs.get("seasonal_order", (2, 1, 0, 52))
+        self.compact = kwargs.get("compact", False)
+        self.alpha = kwargs.get("alpha", 0.05)
+        self.store = ForecastStore()
+        self.versions = {} # Incremented whenever the results of a ticker are replaced, e.g. to invalidate chart caches
+        self.validations = {}
+        self.history_cache_size = kwargs.get("history_cache_size", 32)
+        self._daily_history = OrderedDict() # (ticker, period) -> daily prices, least recently used first
 
     def __repr__(self) -> str:
         '''
@@ -83,6 +115,19 @@ class Forecaster():
                     else:
                         raise KeyError(f'Invalid ticker: {arg}, ticker must be in uppercase only')
 
+    def _history(self, ticker: str, period: str, interval: str) -> pd.DataFrame:
+        '''
+        Retrieves the historical market data of a ticker from yahoo finance
+        Parameters:
+            ticker (str) : ticker to retrieve
+            period (str) : length of time series - '5y', '1y', 'ytd', '10y'
+            interval (str) : Interval of prices - '1wk', '1d', '1mo'
+        Returns:
+            pd.DataFrame with 'Open', 'High', 'Low', 'Close' columns
+        '''
+        stock = yf.Ticker(ticker)
+        return stock.history(period=period, interval=interval)
+
     def forecast(self, *args, **kwargs) -> None:
         '''
         Forecasts with SARIMA
@@ -90,35 +135,364 @@ class Forecaster():
             tickers (str) : tickers to forecast, if none are specified, uses all the tickers stored in object
             price_type (str) : type of price during the interval 'Open', 'Close', 'High', 'Low'
             period (str) : length of time series - '5y', '1y', 'ytd', '10y'
-            interval (str) : Interval of prices - '1wk', '1d'
+            interval (str) : Interval of prices - '1wk', '1d', '1mo'
             order (tuple) : (p, d, q)
             seasonal_order (tuple) : (P, D, Q, m)
+            compact (bool) : whether to keep only the parameters, forecast and confidence interval in self.store,
+                the full model can be rebuilt with rehydrate()
+            alpha (float) : significance level of the confidence intervals
+            queue (WorkQueue) : if specified, the fits are published as tasks of the work queue and run by its workers,
+                results are stored compact, see modules.WorkQueue
+            work (bool) : whether this process also works on the queued tasks, or only waits for other workers
+            histories (dict) : ticker -> prices already retrieved with the same price_type, period and interval
+                (e.g. by screen_forecast()), used instead of downloading them again. Not used with a queue
+        Point forecasts and confidence intervals of every ticker are computed in the same pass and stored in
+        self.store.values as a (tickers x horizon x [mean, lower, upper]) array
         '''
         price_type = kwargs.get("price_type", self.price_type)
         period = kwargs.get("period", self.period)
         interval = kwargs.get("interval", self.interval)
         order = kwargs.get("order", self.order)
         seasonal_order = kwargs.get("seasonal_order", self.seasonal_order)
+        compact = kwargs.get("compact", self.compact)
+        alpha = kwargs.get("alpha", self.alpha)
+        queue = kwargs.get("queue", None)
+        histories = kwargs.get("histories", {})
 
         if not args:
             args = self.tickers.keys()
 
+        if queue is not None:
+            meta = {'price_type': price_type, 'period': period, 'interval': interval,
+                    'order': list(order), 'seasonal_order': list(seasonal_order), 'alpha': alpha}
+            self._forecast_queued(queue, list(args), meta, kwargs.get("work", True))
+            return
+
         for ticker in args:
             logger.info(f'Forecasting for {ticker}')
-            stock = yf.Ticker(ticker)
-            # logger.info(stock.info)
 
             # get historical market data
-            df = stock.history(period=period, interval=interval)
-            if interval == '1wk':
-                ts = df[[price_type]].to_period('W')
-            elif interval == '1d':
-                ts = df[[price_type]].to_period('D')
+            if ticker in histories:
+                ts = histories[ticker]
+            else:
+                df = self._history(ticker, period=period, interval=interval)
+                ts = self._to_period(df, price_type, interval)
+
+            forecast, conf_int, model_fit = self._fit_predict(ts, order, seasonal_order, seasonal_order[-1]+1, alpha)
+            self.store.put(ticker, forecast, conf_int, model_fit.params, order=order, seasonal_order=seasonal_order,
+                           end=ts.index[-1], price_type=price_type, period=period, interval=interval, alpha=alpha)
+            if compact:
+                self.tickers[ticker] = {}
+            else:
+                self.tickers[ticker] = {'ts': ts, 'forecast': forecast, 'model':model_fit}
+            self.versions[ticker] = self.versions.get(ticker, 0) + 1
 
-            model = ARIMA(ts, order=order,seasonal_order=seasonal_order)
-            model_fit = model.fit()
-            forecast = model_fit.predict(start=len(df), end = len(df)+seasonal_order[-1], dynamic=False)     
-            self.tickers[ticker] = {'ts': ts, 'forecast': forecast, 'model':model_fit}
+    def screen_forecast(self, *args, max_error: float = None, quantile: float = 0.9, escalate: bool = True,
+                        methods: list = METHODS, **kwargs) -> pd.DataFrame:
+        '''
+        Forecasts all tickers with cheap baselines (naive, seasonal naive, drift, simple and Holt exponential smoothing)
+        in one vectorized pass, each ticker uses the baseline with the lowest backtest error on its last periods.
+        Tickers where even the best baseline has a poor backtest error are escalated to the full SARIMA fit of forecast().
+        Baselines have no confidence interval, so earlier SARIMA results of the tickers which are not escalated are
+        removed from self.store, and those tickers are excluded by filter_by_uncertainty()
+        Parameters:
+            tickers (str) : tickers to forecast, if none are specified, uses all the tickers stored in object
+            max_error (float) : mean absolute scaled error above which a ticker is escalated,
+                defaults to the quantile of the errors of the universe
+            quantile (float) : quantile of the errors used when max_error is not specified
+            escalate (bool) : whether to fit SARIMA for the escalated tickers, or only report them
+            methods (list) : baseline methods to choose from, see modules.baselines
+            price_type, period, interval, seasonal_order and other kwargs (see documentation on forecast())
+        Returns:
+            pd.DataFrame indexed by ticker with the chosen 'method', its backtest 'error' and whether it was 'escalated'
+        '''
+        price_type = kwargs.get("price_type", self.price_type)
+        period = kwargs.get("period", self.period)
+        interval = kwargs.get("interval", self.interval)
+        seasonal_order = kwargs.get("seasonal_order", self.seasonal_order)
+
+        if not args:
+            args = self.tickers.keys()
+        series = {}
+        for ticker in args:
+            df = self._history(ticker, period=period, interval=interval)
+            series[ticker] = self._to_period(df, price_type, interval)
+        panel = pd.concat({ticker: ts[price_type] for ticker, ts in series.items()}, axis=1).sort_index()
+
+        m = seasonal_order[-1]
+        steps = m + 1
+        logger.info(f'Baseline forecasting for {len(series)} tickers')
+        forecasts, chosen, errors = baseline_forecast(panel.to_numpy(dtype=np.float64).T, steps, m, methods)
+        index = pd.period_range(panel.index[-1] + 1, periods=steps, freq=panel.index.freq)
+        for i, (ticker, ts) in enumerate(series.items()):
+            forecast = pd.Series(forecasts[i], index=index, name='predicted_mean')
+            self.tickers[ticker] = {'ts': ts, 'forecast': forecast, 'baseline': chosen[i]}
+            self.versions[ticker] = self.versions.get(ticker, 0) + 1
+            if ticker in self.store: # The interval of an earlier SARIMA fit does not belong to the baseline forecast
+                self.store.remove(ticker)
+
+        threshold = max_error if max_error is not None else np.nanquantile(errors, quantile)
+        poor = ~(errors <= threshold)
+        results = pd.DataFrame({'method': chosen, 'error': errors, 'escalated': poor}, index=pd.Index(list(series), name='Ticker'))
+        escalated = results.index[poor].to_list()
+        logger.info(f'{len(escalated)} tickers with a backtest error above {threshold:.2f}')
+        if escalate and escalated:
+            self.forecast(*escalated, histories={ticker: series[ticker] for ticker in escalated}, **kwargs)
+        return results
+
+    def forecast_parallel(self, *args, workers: int = None, path: str = None, **kwargs) -> None:
+        '''
+        Forecasts with SARIMA in parallel processes over a shared price panel.
+        The price histories are placed once in shared memory (or memory-mapped files), workers fit on zero-copy views
+        and write the forecasts, confidence intervals and parameters into shared output arrays, only row numbers
+        are sent between processes. Results are stored compact, the models can be rebuilt with rehydrate()
+        Parameters:
+            tickers (str) : tickers to forecast, if none are specified, uses all the tickers stored in object
+            workers (int) : number of processes, defaults to the number of cpus
+            path (str) : if specified, the panel is memory-mapped into files with this prefix instead of shared memory
+            price_type, period, interval, order, seasonal_order, alpha (see documentation on forecast())
+        '''
+        price_type = kwargs.get("price_type", self.price_type)
+        period = kwargs.get("period", self.period)
+        interval = kwargs.get("interval", self.interval)
+        order = kwargs.get("order", self.order)
+        seasonal_order = kwargs.get("seasonal_order", self.seasonal_order)
+        alpha = kwargs.get("alpha", self.alpha)
+
+        if not args:
+            args = self.tickers.keys()
+        series = {}
+        for ticker in args:
+            df = self._history(ticker, period=period, interval=interval)
+            series[ticker] = self._to_period(df, price_type, interval)[price_type]
+
+        steps = seasonal_order[-1]+1
+        panel = SharedPanel.create(series, horizon=steps, path=path)
+        try:
+            rows = range(len(panel))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_panel_worker,
+                                     initargs=(panel.spec, order, seasonal_order, steps, alpha)) as executor:
+                n_params = list(executor.map(_fit_panel_row, rows, chunksize=max(len(panel) // (4 * (workers or 4)), 1)))
+
+            for row, (ticker, ts) in enumerate(series.items()):
+                if not n_params[row]:
+                    logger.info(f'Forecast failed for {ticker}')
+                    continue
+                forecast = pd.Series(panel.output[row, :, 0], index=forecast_periods(ts.index[-1], steps), name='predicted_mean')
+                self.store.put(ticker, forecast, panel.output[row, :, 1:], panel.params[row, :n_params[row]],
+                               order=order, seasonal_order=seasonal_order, end=ts.index[-1], price_type=price_type,
+                               period=period, interval=interval, alpha=alpha)
+                self.tickers[ticker] = {}
+                self.versions[ticker] = self.versions.get(ticker, 0) + 1
+        finally:
+            panel.close()
+
+    def run_task(self, payload: dict) -> dict:
+        '''
+        Fits the forecast of a work queue task, see modules.WorkQueue
+        Parameters:
+            payload (dict) : ticker and parameters of the forecast, see _forecast_queued()
+        Returns:
+            dictionary of the compact results - 'forecast', 'conf_int', 'params' and 'end'
+        '''
+        df = self._history(payload['ticker'], period=payload['period'], interval=payload['interval'])
+        ts = self._to_period(df, payload['price_type'], payload['interval'])
+        seasonal_order = tuple(payload['seasonal_order'])
+        forecast, conf_int, model_fit = self._fit_predict(ts, tuple(payload['order']), seasonal_order,
+                                                          seasonal_order[-1]+1, payload['alpha'])
+        return {'forecast': forecast, 'conf_int': conf_int, 'params': model_fit.params, 'end': ts.index[-1]}
+
+    def _forecast_queued(self, queue: Any, tickers: list, meta: dict, work: bool = True) -> None:
+        '''
+        Publishes one forecast task per ticker, works on them (or waits for other workers) and stores the results.
+        Tasks include the date, so forecasting again on the same day reuses the results already in the queue
+        '''
+        payloads = [{'ticker': ticker, 'as_of': date.today().isoformat(), **meta} for ticker in tickers]
+        keys = queue.publish('forecast', payloads)
+        if work:
+            queue.work({'forecast': self.run_task}, keys=keys)
+        else:
+            queue.join(keys)
+
+        results = queue.results(keys)
+        for ticker, key in zip(tickers, keys):
+            if key not in results:
+                logger.info(f'Forecast task failed for {ticker}')
+                continue
+            result = results[key]
+            self.store.put(ticker, result['forecast'], result['conf_int'], result['params'],
+                           order=tuple(meta['order']), seasonal_order=tuple(meta['seasonal_order']), end=result['end'],
+                           price_type=meta['price_type'], period=meta['period'], interval=meta['interval'], alpha=meta['alpha'])
+            self.tickers[ticker] = {} # Models stay with the workers, see rehydrate()
+            self.versions[ticker] = self.versions.get(ticker, 0) + 1
+
+    def rehydrate(self, ticker: str) -> Any:
+        '''
+        Rebuilds the full statsmodels results of a compact forecast from its stored parameters, without refitting.
+        The price history is retrieved again and cut at the last period used for the fit
+        Parameters:
+            ticker (str) : ticker forecasted in compact mode
+        Returns:
+            statsmodels results object, also saved under 'model' with 'ts' and 'forecast'
+        '''
+        if ticker not in self.store:
+            raise KeyError(f'No compact forecast stored for {ticker}')
+        meta = self.store.meta[self.store.index[ticker]]
+        df = self._history(ticker, period=meta['period'], interval=meta['interval'])
+        ts = self._to_period(df, meta['price_type'], meta['interval']).loc[:meta['end']]
+
+        model = ARIMA(ts, order=meta['order'], seasonal_order=meta['seasonal_order'])
+        model_fit = model.smooth(self.store.get_params(ticker))
+        self.tickers[ticker] = {**(self.tickers.get(ticker) or {}), 'ts': ts, 'forecast': self.store.forecast(ticker), 'model': model_fit}
+        return model_fit
+
+    def filter_by_uncertainty(self, max_width: float, *args, step: int = None) -> list:
+        '''
+        Finds the tickers with forecasts certain enough to act on, from the stored confidence intervals
+        Parameters:
+            max_width (float) : maximum relative width of the confidence interval, (upper - lower) / forecast
+            tickers (str) : tickers to check, if none are specified, uses all the forecasted tickers
+            step (int) : forecast step to check, if None the widest step of each ticker is used
+        Returns:
+            list of tickers within max_width, tickers without a stored confidence interval are excluded
+        '''
+        tickers = list(args) if args else self.store.tickers
+        missing = [ticker for ticker in tickers if ticker not in self.store]
+        if missing:
+            logger.info(f'No confidence interval stored for {missing}, excluded')
+            tickers = [ticker for ticker in tickers if ticker in self.store]
+        if not tickers:
+            return []
+        width = self.store.interval_width(tickers)
+        width = np.nanmax(width, axis=1) if step is None else width[:, step]
+        return [ticker for ticker, keep in zip(tickers, width <= max_width) if keep]
+
+    def _forecast_of(self, ticker: str) -> pd.Series:
+        '''
+        Returns the stored forecast of a ticker, from the ticker data or the compact store, None if not forecasted
+        '''
+        forecast = (self.tickers.get(ticker) or {}).get('forecast', None)
+        if forecast is None and ticker in self.store:
+            forecast = self.store.forecast(ticker)
+        return forecast
+
+    def to_parquet(self, snapshot_date: str = None, universe: str = 'custom', root: str = DATASET_ROOT) -> str:
+        '''
+        Writes the stored forecasts and confidence intervals into the partitioned parquet dataset, see modules.dataset
+        Parameters:
+            snapshot_date (str) : date of the snapshot 'YYYY-MM-DD', defaults to today
+            universe (str) : name of the universe, e.g. 'sp500' or 'portfolio'
+            root (str) : root directory of the datasets
+        Returns:
+            directory of the written partition
+        '''
+        return write_dataset(forecasts_table(self.store), 'forecasts', snapshot_date=snapshot_date, universe=universe, root=root)
+
+    def forecast_multi(self, *args, intervals: Iterable = ('1d', '1wk', '1mo'), horizons: Any = None, refresh: bool = False, **kwargs) -> None:
+        '''
+        Forecasts with SARIMA at several intervals and horizons from one download of daily prices.
+        Daily prices are cached per (ticker, period), up to history_cache_size of them, and resampled in memory into the longer intervals,
+        one model is fitted per interval and the forecasts of all horizons are sliced from it.
+        Parameters:
+            tickers (str) : tickers to forecast, if none are specified, uses all the tickers stored in object
+            intervals (iterable) : intervals to forecast - '1d', '1wk', '1mo'
+            horizons (int, list or dict) : forecast steps, either for all intervals or as {interval: steps},
+                defaults to one seasonal period + 1 of each interval (as in forecast())
+            refresh (bool) : whether to download the daily prices again instead of using the cache
+            seasonal_orders (dict) : {interval: (P, D, Q, m)}, defaults to seasonal_order with m from SEASONAL_PERIODS
+            price_type, period, order, alpha (see documentation on forecast())
+        Stores:
+            the forecast of the first interval under 'ts', 'forecast', 'model' and in self.store with its confidence interval,
+            and every interval under 'intervals' -> {interval: {'ts', 'forecast', 'conf_int', 'model', 'horizons': {steps: forecast}}}
+        '''
+        price_type = kwargs.get("price_type", self.price_type)
+        period = kwargs.get("period", self.period)
+        order = kwargs.get("order", self.order)
+        seasonal_orders = kwargs.get("seasonal_orders", {})
+        alpha = kwargs.get("alpha", self.alpha)
+
+        for interval in intervals:
+            if interval not in PERIOD_FREQUENCIES:
+                raise ValueError(f'Invalid interval: {interval}, must be one of {list(PERIOD_FREQUENCIES)}')
+
+        if not args:
+            args = self.tickers.keys()
+
+        for ticker in args:
+            daily = self._daily_prices(ticker, period, refresh)
+
+            results = {}
+            for interval in intervals:
+                logger.info(f'Forecasting for {ticker} ({interval})')
+                seasonal_order = seasonal_orders.get(interval, (*self.seasonal_order[:3], SEASONAL_PERIODS[interval]))
+                steps = horizons.get(interval) if isinstance(horizons, dict) else horizons
+                if steps is None:
+                    steps = [seasonal_order[-1]+1]
+                elif isinstance(steps, int):
+                    steps = [steps]
+
+                ts = self._resample(daily, price_type, interval)
+                forecast, conf_int, model_fit = self._fit_predict(ts, order, seasonal_order, max(steps), alpha)
+                results[interval] = {'ts': ts, 'forecast': forecast, 'conf_int': conf_int, 'model': model_fit,
+                                     'seasonal_order': seasonal_order, 'horizons': {step: forecast.iloc[:step] for step in steps}}
+
+            interval = next(iter(results))
+            first = results[interval]
+            self.store.put(ticker, first['forecast'], first['conf_int'], first['model'].params, order=order,
+                           seasonal_order=first['seasonal_order'], end=first['ts'].index[-1], price_type=price_type,
+                           period=period, interval=interval, alpha=alpha)
+            self.tickers[ticker] = {'ts': first['ts'], 'forecast': first['forecast'], 'model': first['model'], 'intervals': results}
+            self.versions[ticker] = self.versions.get(ticker, 0) + 1
+
+    def _daily_prices(self, ticker: str, period: str, refresh: bool = False) -> pd.DataFrame:
+        '''
+        Returns the daily prices of a ticker from the cache, downloading them if needed.
+        Only the price columns are kept, and the cache holds at most history_cache_size histories
+        '''
+        key = (ticker, period)
+        if refresh or key not in self._daily_history:
+            logger.info(f'Getting daily prices for {ticker}')
+            df = self._history(ticker, period=period, interval='1d')
+            self._daily_history[key] = df[[col for col in PRICE_AGGREGATIONS if col in df]].astype(np.float64)
+        self._daily_history.move_to_end(key)
+        while len(self._daily_history) > self.history_cache_size:
+            self._daily_history.popitem(last=False)
+        return self._daily_history[key]
+
+    def _to_period(self, df: pd.DataFrame, price_type: str, interval: str) -> pd.DataFrame:
+        '''
+        Converts the price history of an interval into a time series with a period index
+        '''
+        if interval not in PERIOD_FREQUENCIES:
+            raise ValueError(f'Invalid interval: {interval}, must be one of {list(PERIOD_FREQUENCIES)}')
+        return df[[price_type]].to_period(PERIOD_FREQUENCIES[interval])
+
+    def _resample(self, daily: pd.DataFrame, price_type: str, interval: str) -> pd.DataFrame:
+        '''
+        Aggregates daily prices into a longer interval, e.g. the weekly close is the last daily close of the week
+        '''
+        ts = self._to_period(daily, price_type, interval)
+        if interval == '1d':
+            return ts
+        return ts.groupby(level=0).agg(PRICE_AGGREGATIONS.get(price_type, 'last'))
+
+    def _fit_predict(self, ts: pd.DataFrame, order: tuple, seasonal_order: tuple, steps: int, alpha: float = 0.05) -> tuple:
+        '''
+        Fits SARIMA on a time series and forecasts the following periods with their confidence interval
+        Returns:
+            (forecast, conf_int, model_fit)
+        '''
+        # Daily prices skip weekends and holidays, statsmodels would count their forecast in calendar days from the first date,
+        # so series with gaps are fitted on their positions and the forecast is labelled from the last period
+        index = ts.index
+        gaps = isinstance(index, pd.PeriodIndex) and len(index) > 0 and index[-1].ordinal - index[0].ordinal + 1 != len(index)
+        model = ARIMA(ts.reset_index(drop=True) if gaps else ts, order=order,seasonal_order=seasonal_order)
+        model_fit = model.fit()
+        prediction = model_fit.get_forecast(steps=steps)
+        forecast, conf_int = prediction.predicted_mean, prediction.conf_int(alpha=alpha)
+        if gaps:
+            forecast.index = conf_int.index = forecast_periods(index[-1], steps)
+        return forecast, conf_int, model_fit
 
     def forecast_validation(self, ticker:str = None, validation_periods:int = 52, plot:bool=True, forecast_period_only = True, **kwargs) -> tuple:
         '''
@@ -139,15 +513,10 @@ class Forecaster():
         if not ticker:
             ticker = list(self.tickers.keys())[0]
         logger.info(f'Validating forecast for {ticker}')
-        stock = yf.Ticker(ticker)
-        # logger.info(stock.info)
 
         # Get historical market data
-        df = stock.history(period=period, interval=interval)
-        if interval == '1wk':
-            ts = df[[price_type]].to_period('W')
-        elif interval == '1d':
-            ts = df[[price_type]].to_period('D')
+        df = self._history(ticker, period=period, interval=interval)
+        ts = self._to_period(df, price_type, interval)
         
         train, test = ts[:-validation_periods], ts[-validation_periods:]
         logger.info(f'Train periods: {len(train)}, Validation periods: {len(test)}')
@@ -162,18 +531,12 @@ class Forecaster():
         logger.info(f'MSE: {mse}')
         logger.info(f'AIC: {model_fit.aic}')
 
+        self.validations[ticker] = {'test': test, 'forecast': forecast, 'ts': ts, 'mse': mse, 'aic': model_fit.aic}
+
         # Plot both yhat and y
         if plot:
-            plt.figure(figsize=(14,6))
-            plt.title(f'Validation for {ticker}')
-            plt.plot(test.to_timestamp(), color='grey', label='Actual')
-            plt.plot(forecast.to_timestamp().shift(-1), color='salmon', label='Forecast')
-            if not forecast_period_only:
-                plt.plot(ts.to_timestamp())
-            else:
-                plt.xticks(forecast.index, rotation=45, fontsize=8)
-                plt.legend()
-                plt.grid()
+            fig, ax = plt.subplots(figsize=FIGSIZE)
+            draw_validation(ax, ticker, test, forecast, ts, forecast_period_only)
         return mse, model_fit.aic
     
     def plot_forecast(self, ticker: str=None, forecast_only: bool=False):
@@ -183,40 +546,71 @@ class Forecaster():
             ticker (str) : ticker to plot from stored forecast
             forecast_only (bool) : whether to plot only the forecast or include past_prices
         '''
-        try:
-            # Use the init ticker
-            if not ticker:
-                ticker = list(self.tickers.keys())[0]
-            ticker_data = self.tickers[ticker]
-            ts, forecast = ticker_data['ts'], ticker_data['forecast']
-
-            # Use .to_timestamp() to convert period back into timestamp for plotting
-            plt.figure(figsize=(14,6))
-            plt.title(f'Forecast for {ticker}')
-            plt.plot(forecast.to_timestamp(), color='salmon', label='Forecast')
-            if not forecast_only:
-                plt.plot(ts.to_timestamp(), color='grey', label='Actual')
-            else:
-                plt.xticks(forecast.index, rotation=45, fontsize=8)
-                plt.grid()
-            plt.legend()
+        # Use the init ticker
+        if not ticker:
+            ticker = list(self.tickers.keys())[0]
+        if self._forecast_of(ticker) is None:
+            logger.info(f'No forecasting done yet for {ticker}')
+            return
+        fig, ax = plt.subplots(figsize=FIGSIZE)
+        draw_forecast(ax, **self._chart_data(ticker, forecast_only))
+
+    def _chart_data(self, ticker: str, forecast_only: bool = False) -> dict:
+        '''
+        Collects the stored results of a ticker for draw_forecast(), without refitting
+        '''
+        ts, forecast = (self.tickers.get(ticker) or {}).get('ts', None), self._forecast_of(ticker)
+        data = {'ticker': ticker, 'forecast': forecast, 'ts': ts, 'forecast_only': forecast_only}
+        if ticker in self.store:
+            data['conf_int'] = self.store.conf_int(ticker)
+            data['confidence'] = round((1 - self.store.meta[self.store.index[ticker]]['alpha']) * 100)
+        return data
+
+    def render_charts(self, *args, out_dir: str = 'reports/charts', formats: tuple = ('png',), kinds: tuple = ('forecast', 'validation'),
+                      forecast_only: bool = False, workers: int = None, dpi: int = 100) -> list:
+        '''
+        Writes the forecast and validation charts of tickers to files, rendered off-screen in parallel processes
+        from the stored results of forecast() and forecast_validation(), nothing is refitted
+        Parameters:
+            tickers (str) : tickers to render, if none are specified, uses all the tickers with stored results
+            out_dir (str) : directory of the files, named <ticker>_<kind>.<format>
+            formats (tuple) : file formats, e.g. ('png', 'svg')
+            kinds (tuple) : charts to render - 'forecast', 'validation'
+            forecast_only (bool) : whether to plot only the forecast or include past prices
+            workers (int) : number of processes, defaults to the number of cpus
+            dpi (int) : resolution of raster formats
+        Returns:
+            list of the written filepaths
+        '''
+        tickers = list(args) if args else list(dict.fromkeys([*self.tickers, *self.validations]))
+
+        def jobs():
+            for ticker in tickers:
+                if 'forecast' in kinds and self._forecast_of(ticker) is not None:
+                    yield ticker, 'forecast', self._chart_data(ticker, forecast_only)
+                if 'validation' in kinds and ticker in self.validations:
+                    validation = self.validations[ticker]
+                    yield ticker, 'validation', {'ticker': ticker, 'test': validation['test'], 'forecast': validation['forecast'],
+                                                 'ts': validation['ts'], 'forecast_period_only': forecast_only}
 
-        except AttributeError as e:
-            logger.info(f'No forecasting done yet for {ticker}')            
+        return render_chart_pack(jobs(), out_dir=out_dir, formats=formats, workers=workers, dpi=dpi)
 
-    def find_max_profit(self, *args):
+    def find_max_profit(self, *args, max_uncertainty: float = None):
         '''
         Finds the maximum profit possible without trading
         Parameters:
             ticker (str) : ticker to plot from stored forecast
+            max_uncertainty (float) : if specified, skips tickers with a relative confidence interval wider than this
         '''
         if not args:
             args = self.tickers.keys()
+        if max_uncertainty is not None:
+            args = self.filter_by_uncertainty(max_uncertainty, *args)
 
         for ticker in args:
             try:
                 ticker_data = self.tickers.get(ticker, None)     
-                forecast = ticker_data.get('forecast', None)  
+                forecast = self._forecast_of(ticker)
                 max_profit = 0
                 high, low = None, None
                 last_profit = None
@@ -257,11 +651,12 @@ class Forecaster():
 
                 
 
-                # Create final buy and sell action on the current period
-                data[buy]['action'], data[sell]['action'] = 'buy', 'sell'
+                # Create final buy and sell action on the current period, flat or declining forecasts have no trade
+                if max_profit > 0:
+                    data[buy]['action'], data[sell]['action'] = 'buy', 'sell'
                 df = pd.DataFrame(data).T
+                df = df.reindex(columns=['current', 'profit %', 'new_low', 'new_high', 'new_max_profit', 'action'])
                 df = df.fillna('')
-                df = df[['current', 'profit %', 'new_low', 'new_high', 'new_max_profit', 'action']]
 
                 # Filter for buy and sell action only
                 actions = df[(df['action']=='buy') | (df['action']=='sell')][['current', 'profit %', 'action']]
@@ -275,19 +670,22 @@ class Forecaster():
             except Exception as e:
                 raise Exception(e)
             
-    def find_best_trades(self, *args):
+    def find_best_trades(self, *args, max_uncertainty: float = None):
         '''
         Finds all the trades and returns best n trades
         Parameters:
             ticker (str) : ticker to plot from stored forecast
+            max_uncertainty (float) : if specified, skips tickers with a relative confidence interval wider than this
         '''
         if not args:
             args = self.tickers.keys()
+        if max_uncertainty is not None:
+            args = self.filter_by_uncertainty(max_uncertainty, *args)
 
         for ticker in args:
             try:
                 ticker_data = self.tickers.get(ticker, None)     
-                forecast = ticker_data.get('forecast', None)  
+                forecast = self._forecast_of(ticker)
                 low = None
                 data = {}
                 for period, price in zip(forecast.index, forecast):
@@ -321,8 +719,8 @@ class Forecaster():
                     last_price, last_idx = price, period
 
                 df = pd.DataFrame(data).T
+                df = df.reindex(columns=['current', 'profit %', 'action', 'hold period']) # Columns are missing without trades
                 df = df.fillna('')
-                df = df[['current', 'profit %', 'action', 'hold period']]
 
                 # Filter for buy and sell action only
                 actions = df[(df['action']=='buy') | (df['action']=='sell')][['current', 'profit %', 'action', 'hold period']]
@@ -344,3 +742,34 @@ class Forecaster():
                 raise AttributeError(f'No forecasting done yet for {ticker}')
             except Exception as e:
                 raise Exception(e)
+
+_panel_worker = {}
+
+def _init_panel_worker(spec: dict, order: tuple, seasonal_order: tuple, steps: int, alpha: float) -> None:
+    '''
+    Attaches a worker process to the shared panel once
+    '''
+    _panel_worker.update(panel=SharedPanel.attach(spec), order=order, seasonal_order=seasonal_order, steps=steps, alpha=alpha)
+
+def _fit_panel_row(row: int) -> int:
+    '''
+    Fits the ticker of a row of the shared panel and writes its results into the shared output arrays
+    Returns:
+        number of fitted parameters, 0 if the fit failed
+    '''
+    panel = _panel_worker['panel']
+    try:
+        model = ARIMA(panel.series(row), order=_panel_worker['order'], seasonal_order=_panel_worker['seasonal_order'])
+        model_fit = model.fit()
+        prediction = model_fit.get_forecast(steps=_panel_worker['steps'])
+    except Exception as e:
+        logger.info(f'Failed to fit {panel.tickers[row]}: {e!r}')
+        return 0
+    params = np.asarray(model_fit.params, dtype=np.float64)
+    if len(params) > panel.params.shape[1]:
+        logger.info(f'Too many parameters for {panel.tickers[row]}: {len(params)}')
+        return 0
+    panel.output[row, :, 0] = np.asarray(prediction.predicted_mean)
+    panel.output[row, :, 1:] = np.asarray(prediction.conf_int(alpha=_panel_worker['alpha']))
+    panel.params[row, :len(params)] = params
+    return len(params)
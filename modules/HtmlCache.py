@@ -0,0 +1,123 @@
+import os
+import zlib
+import sqlite3
+import hashlib
+from datetime import date
+from contextlib import closing
+from modules.utils import logger
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT NOT NULL,
+    fetch_date TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (url, fetch_date)
+);
+CREATE INDEX IF NOT EXISTS pages_date ON pages (fetch_date);
+'''
+
+class HtmlCache():
+    '''
+    Content addressed store of raw responses.
+    Every distinct body is compressed once under its sha256 digest, and an index maps (url, fetch date) to the digest,
+    so pages which did not change between fetches are stored once and any past scrape can be re-parsed offline
+    '''
+    def __init__(self, root: str = 'data/cache/html', level: int = 6) -> None:
+        '''
+        Parameters:
+            root (str) : directory of the index and the compressed objects
+            level (int) : zlib compression level
+        '''
+        self.root = root
+        self.level = level
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def __repr__(self) -> str:
+        with closing(self._connect()) as conn:
+            pages, objects = conn.execute('SELECT COUNT(*), COUNT(DISTINCT digest) FROM pages').fetchone()
+        return f'HtmlCache(root={self.root}, pages={pages}, objects={objects})'
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(os.path.join(self.root, 'index.sqlite'), timeout=60, isolation_level=None)
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, 'objects', digest[:2], f'{digest}.z')
+
+    def put(self, url: str, html: str, fetch_date: str = None) -> str:
+        '''
+        Stores a response, the body is only written if no identical body is stored yet
+        Parameters:
+            url (str) : url of the response
+            html (str) : body of the response
+            fetch_date (str) : date of the fetch 'YYYY-MM-DD', defaults to today
+        Returns:
+            digest of the body
+        '''
+        data = html.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        filepath = self._object_path(digest)
+        if not os.path.exists(filepath):
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            temp = f'{filepath}.{os.getpid()}.tmp'
+            with open(temp, 'wb') as f:
+                f.write(zlib.compress(data, self.level))
+            os.replace(temp, filepath) # Readers never see a partially written object
+        with closing(self._connect()) as conn:
+            conn.execute('INSERT OR REPLACE INTO pages (url, fetch_date, digest) VALUES (?, ?, ?)',
+                         (url, fetch_date or date.today().isoformat(), digest))
+        return digest
+
+    def get(self, url: str, fetch_date: str = None) -> str:
+        '''
+        Parameters:
+            url (str) : url of the response
+            fetch_date (str) : date of the fetch 'YYYY-MM-DD', defaults to the latest fetch
+        Returns:
+            body of the response, None if it is not cached
+        '''
+        with closing(self._connect()) as conn:
+            if fetch_date is None:
+                row = conn.execute('SELECT digest FROM pages WHERE url = ? ORDER BY fetch_date DESC LIMIT 1', (url,)).fetchone()
+            else:
+                row = conn.execute('SELECT digest FROM pages WHERE url = ? AND fetch_date = ?', (url, fetch_date)).fetchone()
+        return None if row is None else self.read(row[0])
+
+    def read(self, digest: str) -> str:
+        '''
+        Returns:
+            body stored under a digest
+        '''
+        with open(self._object_path(digest), 'rb') as f:
+            return zlib.decompress(f.read()).decode('utf-8')
+
+    def entries(self, fetch_date: str = None) -> dict:
+        '''
+        Parameters:
+            fetch_date (str) : date of the fetches, defaults to the latest date
+        Returns:
+            dictionary of url -> digest of the responses fetched on that date
+        '''
+        fetch_date = fetch_date or (self.dates() or [None])[-1]
+        with closing(self._connect()) as conn:
+            return dict(conn.execute('SELECT url, digest FROM pages WHERE fetch_date = ?', (fetch_date,)).fetchall())
+
+    def dates(self) -> list:
+        '''
+        Returns:
+            sorted list of the fetch dates
+        '''
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute('SELECT DISTINCT fetch_date FROM pages ORDER BY fetch_date')]
+
+    def import_pages(self, pages: dict, fetch_date: str = None) -> None:
+        '''
+        Stores already fetched responses, e.g. saved pages used as offline fixtures
+        Parameters:
+            pages (dict) : url -> body
+            fetch_date (str) : date of the fetches 'YYYY-MM-DD', defaults to today
+        '''
+        for url, html in pages.items():
+            self.put(url, html, fetch_date)
+        logger.info(f'Imported {len(pages)} pages into {self.root}')
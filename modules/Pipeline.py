@@ -0,0 +1,282 @@
+import os
+import json
+import pickle
+import hashlib
+from typing import Any, Callable
+import pandas as pd
+import numpy as np
+from modules.utils import logger
+
+ALL = '*' # Key of the outputs of universe wide stages
+SEGMENT_FEATURES = ['Market Cap (B)', 'Revenue (ttm) (B)', 'Profit Margin (%)','Quarterly Earnings Growth (yoy) (%)', '52 Week Change (%)']
+
+def content_hash(obj: Any) -> str:
+    '''
+    Hash of the content of an object, equal for equal dataframes, series, arrays and containers of them
+    '''
+    h = hashlib.sha1()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        h.update(type(obj).__name__.encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        if isinstance(obj, pd.DataFrame):
+            h.update(repr(list(obj.columns)).encode())
+    elif isinstance(obj, np.ndarray):
+        h.update(f'{obj.dtype}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=repr):
+            h.update(repr(key).encode())
+            h.update(content_hash(obj[key]).encode())
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            h.update(content_hash(item).encode())
+    else:
+        h.update(repr(obj).encode())
+    return h.hexdigest()
+
+class Pipeline():
+    '''
+    Dependency tracked pipeline of stages, from sources (e.g. price bars, scraped pages) to outputs (e.g. signals, segments).
+    Every output is recorded with the hash of its inputs and parameters, so a run only recomputes the stages and
+    tickers whose inputs changed. Per ticker stages run for every ticker, universe stages run once over all tickers
+    '''
+    def __init__(self, cache_dir: str = 'data/cache/pipeline') -> None:
+        '''
+        Parameters:
+            cache_dir (str) : directory of the outputs and the manifest of their hashes, None to only keep them in memory
+        '''
+        self.cache_dir = cache_dir
+        self.stages = {}
+        self.sources = {}
+        self.manifest = {} # stage -> ticker -> {'key': hash of the inputs, 'hash': hash of the output or 'error'}
+        self._outputs = {}
+        if cache_dir and os.path.exists(os.path.join(cache_dir, 'manifest.json')):
+            with open(os.path.join(cache_dir, 'manifest.json')) as f:
+                saved = json.load(f)
+            self.manifest = saved['records']
+            self.sources = {name: set(self.manifest.get(name, {})) for name in saved['sources']}
+
+    def __repr__(self) -> str:
+        return f'Pipeline(sources={list(self.sources)}, stages={list(self.stages)})'
+
+    def __getitem__(self, stage: str) -> Any:
+        return self.outputs(stage)
+
+    def source(self, name: str, data: dict, replace: bool = False) -> list:
+        '''
+        Sets the values of a source by ticker, only the tickers whose content changed are marked as changed
+        Parameters:
+            name (str) : name of the source, e.g. 'prices'
+            data (dict) : ticker -> value
+            replace (bool) : whether the tickers missing from data are removed from the source
+        Returns:
+            list of the changed tickers
+        '''
+        self.sources.setdefault(name, set())
+        records = self.manifest.setdefault(name, {})
+        outputs = self._outputs.setdefault(name, {})
+        if replace:
+            for ticker in set(records) - set(data):
+                records.pop(ticker)
+                outputs.pop(ticker, None)
+        changed = []
+        for ticker, value in data.items():
+            digest = content_hash(value)
+            outputs[ticker] = value
+            if records.get(ticker, {}).get('hash') != digest:
+                records[ticker] = {'key': digest, 'hash': digest}
+                self._save(name, ticker, value)
+                changed.append(ticker)
+        self.sources[name] = set(records)
+        logger.info(f'Source {name}: {len(changed)} of {len(data)} tickers changed')
+        return changed
+
+    def stage(self, name: str, func: Callable, inputs: list, per_ticker: bool = True, params: dict = None) -> None:
+        '''
+        Adds a stage, stages must be added after their inputs
+        Parameters:
+            name (str) : name of the stage
+            func (callable) : per ticker stages are called as func(ticker, *inputs) with the values of the ticker,
+                universe stages as func(*inputs) with dictionaries of ticker -> value of per ticker inputs
+            inputs (list) : names of the sources and stages used
+            per_ticker (bool) : whether the stage runs for every ticker or once for the universe
+            params (dict) : parameters of the stage, changing them recomputes the stage
+        '''
+        for dependency in inputs:
+            if dependency not in self.stages and dependency not in self.sources:
+                raise KeyError(f'Unknown input {dependency} of stage {name}')
+        self.stages[name] = {'func': func, 'inputs': inputs, 'per_ticker': per_ticker, 'params': params or {}}
+
+    def _is_per_ticker(self, name: str) -> bool:
+        return name in self.sources or self.stages[name]['per_ticker']
+
+    def _tickers(self, name: str) -> set:
+        '''
+        Tickers of a per ticker source or stage, the tickers present in all its per ticker inputs
+        '''
+        if name in self.sources:
+            return self.sources[name]
+        tickers = None
+        for dependency in self.stages[name]['inputs']:
+            if self._is_per_ticker(dependency):
+                tickers = self._tickers(dependency) if tickers is None else tickers & self._tickers(dependency)
+        return tickers or set()
+
+    def run(self, targets: list = None) -> dict:
+        '''
+        Runs the stages needed by the targets, only recomputing outputs whose inputs or parameters changed
+        Parameters:
+            targets (list) : stages to bring up to date, defaults to all
+        Returns:
+            dictionary of stage -> {'computed', 'skipped', 'failed'} counts of tickers
+        '''
+        order = self._order(targets or list(self.stages))
+        report = {}
+        for name in order:
+            stage = self.stages[name]
+            records = self.manifest.setdefault(name, {})
+            params_hash = content_hash(stage['params'])
+            counts = {'computed': 0, 'skipped': 0, 'failed': 0}
+            if stage['per_ticker']:
+                tickers = sorted(self._tickers(name))
+                for ticker in set(records) - set(tickers):
+                    records.pop(ticker) # Tickers removed from the sources
+                    self._outputs.get(name, {}).pop(ticker, None)
+            else:
+                tickers = [ALL]
+
+            for ticker in tickers:
+                key = content_hash([params_hash, *[self._input_hash(dependency, ticker) for dependency in stage['inputs']]])
+                if records.get(ticker, {}).get('key') == key:
+                    counts['skipped'] += 1
+                    continue
+                try:
+                    args = [self._input_value(dependency, ticker) for dependency in stage['inputs']]
+                    output = stage['func'](ticker, *args) if stage['per_ticker'] else stage['func'](*args)
+                except Exception as e:
+                    # Failures are recorded too, so they are only retried once their inputs change
+                    logger.info(f'Stage {name} failed for {ticker}: {e!r}')
+                    records[ticker] = {'key': key, 'error': repr(e)}
+                    self._outputs.get(name, {}).pop(ticker, None)
+                    counts['failed'] += 1
+                    continue
+                records[ticker] = {'key': key, 'hash': content_hash(output)}
+                self._outputs.setdefault(name, {})[ticker] = output
+                self._save(name, ticker, output)
+                counts['computed'] += 1
+            logger.info(f'Stage {name}: {counts}')
+            report[name] = counts
+        self._save_manifest()
+        return report
+
+    def outputs(self, name: str) -> Any:
+        '''
+        Returns:
+            dictionary of ticker -> output of a per ticker stage or source, or the output of a universe stage
+        '''
+        if not self._is_per_ticker(name):
+            return self._load(name, ALL)
+        records = self.manifest.get(name, {})
+        return {ticker: self._load(name, ticker) for ticker in sorted(self._tickers(name)) if 'hash' in records.get(ticker, {})}
+
+    def _order(self, targets: list) -> list:
+        '''
+        Stages needed by the targets, in dependency order
+        '''
+        order = []
+        def visit(name):
+            if name in self.sources or name in order:
+                return
+            for dependency in self.stages[name]['inputs']:
+                visit(dependency)
+            order.append(name)
+        for target in targets:
+            visit(target)
+        return order
+
+    def _input_hash(self, name: str, ticker: str) -> str:
+        records = self.manifest.get(name, {})
+        if self._is_per_ticker(name):
+            if ticker == ALL: # Universe stages depend on every ticker of their per ticker inputs
+                return content_hash({t: records[t].get('hash', '') for t in sorted(self._tickers(name)) if t in records})
+            return records.get(ticker, {}).get('hash', '')
+        return records.get(ALL, {}).get('hash', '')
+
+    def _input_value(self, name: str, ticker: str) -> Any:
+        if self._is_per_ticker(name) and ticker == ALL:
+            return self.outputs(name)
+        return self._load(name, ticker if self._is_per_ticker(name) else ALL)
+
+    def _filepath(self, name: str, ticker: str) -> str:
+        return os.path.join(self.cache_dir, name, f"{'_all' if ticker == ALL else ticker}.pkl")
+
+    def _save(self, name: str, ticker: str, value: Any) -> None:
+        if not self.cache_dir:
+            return
+        filepath = self._filepath(name, ticker)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'wb') as f:
+            pickle.dump(value, f)
+
+    def _load(self, name: str, ticker: str) -> Any:
+        outputs = self._outputs.setdefault(name, {})
+        if ticker not in outputs:
+            if 'hash' not in self.manifest.get(name, {}).get(ticker, {}):
+                raise KeyError(f'No output of {name} for {ticker}, run the pipeline first or check its errors')
+            with open(self._filepath(name, ticker), 'rb') as f:
+                outputs[ticker] = pickle.load(f)
+        return outputs[ticker]
+
+    def _save_manifest(self) -> None:
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp = os.path.join(self.cache_dir, 'manifest.json.tmp')
+        with open(temp, 'w') as f:
+            json.dump({'sources': list(self.sources), 'records': self.manifest}, f)
+        os.replace(temp, os.path.join(self.cache_dir, 'manifest.json'))
+
+    @classmethod
+    def standard(cls, forecaster: Any, scrapper: Any, features: list = SEGMENT_FEATURES, n_clusters: int = 8, **kwargs) -> 'Pipeline':
+        '''
+        Builds the usual chains, with the sources 'prices' (ticker -> time series with a period index, as in forecaster.tickers[ticker]['ts'])
+        and 'statistics' (ticker -> uncleaned dataframe, e.g. YfScrapper._parse_stats_page(..., clean_df=False)):
+            prices -> forecast -> signals (max_profit and best_trades)
+            statistics -> clean -> compile -> segments (K-means cluster of every ticker)
+        Parameters:
+            forecaster (Forecaster) : forecaster whose order, seasonal_order and alpha are used
+            scrapper (YfScrapper) : scrapper used to clean the statistics
+            features (list) : statistics used for the segmentation
+            n_clusters (int) : number of segments
+        '''
+        pipeline = cls(**kwargs)
+        for name in ['prices', 'statistics']:
+            pipeline.sources.setdefault(name, set())
+        order, seasonal_order, alpha = forecaster.order, forecaster.seasonal_order, forecaster.alpha
+
+        def forecast(ticker, ts):
+            predicted_mean, conf_int, model_fit = forecaster._fit_predict(ts, order, seasonal_order, seasonal_order[-1]+1, alpha)
+            return {'forecast': predicted_mean, 'conf_int': conf_int, 'params': model_fit.params}
+
+        rules = type(forecaster)() # The rules run on a scratch forecaster, so the results of the caller are left untouched
+
+        def signals(ticker, result):
+            rules.tickers = {ticker: {'forecast': result['forecast']}}
+            rules.find_max_profit(ticker)
+            rules.find_best_trades(ticker)
+            return {'max_profit': rules.tickers[ticker]['max_profit'], 'best_trades': rules.tickers[ticker]['best_trades']}
+
+        def segments(df):
+            from sklearn import preprocessing
+            from sklearn.cluster import KMeans
+            X = df.reindex(columns=features).apply(pd.to_numeric, errors='coerce').fillna(0)
+            model = KMeans(random_state=42, init='k-means++', n_clusters=min(n_clusters, len(X)))
+            model.fit(preprocessing.MinMaxScaler().fit_transform(X))
+            return pd.Series(model.labels_, index=X.index, name='Cluster')
+
+        pipeline.stage('forecast', forecast, ['prices'], params={'order': order, 'seasonal_order': seasonal_order, 'alpha': alpha})
+        pipeline.stage('signals', signals, ['forecast'])
+        pipeline.stage('clean', lambda ticker, df: scrapper.clean_df(df.copy()), ['statistics'])
+        pipeline.stage('compile', lambda cleaned: pd.concat([cleaned[ticker] for ticker in sorted(cleaned)]), ['clean'], per_ticker=False)
+        pipeline.stage('segments', segments, ['compile'], per_ticker=False, params={'features': features, 'n_clusters': n_clusters})
+        return pipeline
@@ -0,0 +1,173 @@
+import operator
+from typing import Any
+import pandas as pd
+import numpy as np
+from modules.snapshots import load_snapshot, normalize_metric, resolve_metric, snapshot_dates, SNAPSHOT_PATTERN
+from modules.utils import logger
+
+# Ranking metrics with a sorted index built up front, other metrics are sorted on first use
+RANK_METRICS = [
+    'Market Cap (B)',
+    'Trailing P/E',
+    'Forward P/E',
+    'Profit Margin (%)',
+    'Revenue (ttm) (B)',
+    'Quarterly Revenue Growth (yoy) (%)',
+    '52 Week Change (%)',
+    'Forward Annual Dividend Yield (%)',
+]
+OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+class Screener():
+    '''
+    Cross-sectional screening of statistics snapshots.
+    Every snapshot is held as typed float columns, filters are evaluated as vectorized masks
+    and rankings use sorted indexes, so screens over thousands of tickers answer in interactive time
+    '''
+    def __init__(self, snapshots: Any = None, rank_metrics: list = RANK_METRICS) -> None:
+        '''
+        Parameters:
+            snapshots (pd.DataFrame or dict) : a snapshot indexed by ticker (e.g. YfScrapper.compile_dataframes())
+                or dictionary of date -> snapshot
+            rank_metrics (list) : metrics to build sorted indexes for
+        '''
+        self.rank_metrics = rank_metrics
+        self.snapshots = {}
+        if isinstance(snapshots, pd.DataFrame):
+            self.add_snapshot('latest', snapshots)
+        elif snapshots:
+            for date, df in snapshots.items():
+                self.add_snapshot(date, df)
+
+    def __repr__(self) -> str:
+        return f'Screener(snapshots={list(self.snapshots)})'
+
+    @classmethod
+    def from_files(cls, pattern: str = SNAPSHOT_PATTERN, **kwargs) -> 'Screener':
+        '''
+        Loads all the dated snapshots matching a glob pattern, e.g. 'data/s&p_*.csv'
+        '''
+        return cls({date: load_snapshot(filepath) for date, filepath in snapshot_dates(pattern).items()}, **kwargs)
+
+    @property
+    def dates(self) -> list:
+        return list(self.snapshots)
+
+    def metrics(self, date: str = None) -> list:
+        '''
+        Returns:
+            list of the numerical metrics available in a snapshot
+        '''
+        return list(self._snapshot(date)['columns'])
+
+    def add_snapshot(self, date: str, df: pd.DataFrame) -> None:
+        '''
+        Casts a snapshot into typed float columns and builds the sorted indexes of the ranking metrics
+        Parameters:
+            date (str) : date of the snapshot
+            df (pd.DataFrame) : snapshot indexed by ticker with metrics as the columns
+        '''
+        columns = {}
+        for col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+            # Drops text and date columns, which have no numerical values
+            if not np.isnan(values).all():
+                columns[normalize_metric(col)] = values
+        snapshot = {'tickers': df.index.to_numpy(dtype=str), 'columns': columns, 'sorted': {}}
+        self.snapshots[date] = snapshot
+        for metric in self.rank_metrics:
+            if metric in columns:
+                self._sorted(snapshot, metric)
+        logger.info(f'Snapshot {date} added with {len(df)} tickers and {len(columns)} metrics')
+
+    def screen(self, filters: Any = None, rank_by: str = None, ascending: bool = False, top: int = None,
+               date: str = None, columns: list = None) -> pd.DataFrame:
+        '''
+        Screens a snapshot with declarative filters and an optional ranking
+        Parameters:
+            filters (list or dict) : [(metric, op, value)] or {metric: (op, value)}, op is one of
+                '<', '<=', '>', '>=', '==', '!=' or 'between' with value as (low, high)
+            rank_by (str) : metric to rank the tickers by
+            ascending (bool) : ranking direction
+            top (int) : number of tickers to return
+            date (str) : snapshot to screen, defaults to the latest snapshot
+            columns (list) : metrics to return, defaults to the filtered and ranked metrics
+        Returns:
+            pd.DataFrame indexed by ticker
+        Example:
+            screener.screen([('Trailing P/E', '<', 20), ('Profit Margin', '>', 15)], rank_by='Market Cap (B)', top=10)
+        '''
+        snapshot = self._snapshot(date)
+        mask, used = self._mask(snapshot, filters)
+
+        if rank_by:
+            rank_by = resolve_metric(rank_by, list(snapshot['columns']))
+            order = self._sorted(snapshot, rank_by)
+            if not ascending:
+                order = order[::-1]
+            rows = order[mask[order]]
+            used.append(rank_by)
+        else:
+            rows = np.flatnonzero(mask)
+        if top:
+            rows = rows[:top]
+
+        columns = [resolve_metric(col, list(snapshot['columns'])) for col in columns] if columns else list(dict.fromkeys(used))
+        return pd.DataFrame({col: snapshot['columns'][col][rows] for col in columns},
+                            index=pd.Index(snapshot['tickers'][rows], name='Ticker'))
+
+    def screen_all(self, filters: Any = None, **kwargs) -> pd.DataFrame:
+        '''
+        Runs the same screen over every snapshot (see documentation on screen())
+        Returns:
+            pd.DataFrame indexed by (date, ticker)
+        '''
+        results = {date: self.screen(filters, date=date, **kwargs) for date in self.snapshots}
+        return pd.concat(results, names=['Date', 'Ticker'])
+
+    def _snapshot(self, date: str = None) -> dict:
+        if not self.snapshots:
+            raise KeyError('No snapshots added to the screener')
+        if date is None:
+            date = max(self.snapshots)
+        return self.snapshots[date]
+
+    def _mask(self, snapshot: dict, filters: Any) -> tuple:
+        '''
+        Combines the filters into a boolean mask over the tickers, NaN values never pass a filter
+        Returns:
+            (mask, list of filtered metrics)
+        '''
+        if isinstance(filters, dict):
+            filters = [(metric, *condition) for metric, condition in filters.items()]
+        mask = np.ones(len(snapshot['tickers']), dtype=bool)
+        used = []
+        for metric, op, value in filters or []:
+            metric = resolve_metric(metric, list(snapshot['columns']))
+            values = snapshot['columns'][metric]
+            mask &= ~np.isnan(values) # NaN != value would otherwise pass
+            if op == 'between':
+                mask &= (values >= value[0]) & (values <= value[1])
+            elif op in OPERATORS:
+                mask &= OPERATORS[op](values, value)
+            else:
+                raise ValueError(f'Invalid operator: {op}, must be one of {list(OPERATORS)} or between')
+            used.append(metric)
+        return mask, used
+
+    def _sorted(self, snapshot: dict, metric: str) -> np.ndarray:
+        '''
+        Returns the rows of a metric in ascending order excluding NaN values, cached per snapshot
+        '''
+        if metric not in snapshot['sorted']:
+            values = snapshot['columns'][metric]
+            order = np.argsort(values, kind='stable')
+            snapshot['sorted'][metric] = order[~np.isnan(values[order])]
+        return snapshot['sorted'][metric]
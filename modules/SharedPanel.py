@@ -0,0 +1,132 @@
+from typing import Any
+from multiprocessing import shared_memory
+import pandas as pd
+import numpy as np
+
+class SharedPanel():
+    '''
+    Price panel of a universe in one contiguous float array, in shared memory or a memory-mapped file,
+    with an index of the offset, length and first period of every ticker.
+    Worker processes attach to it by name and get zero-copy views of the series, and write their results
+    into preallocated shared output arrays, so neither prices nor results are pickled between processes
+    '''
+    def __init__(self, spec: dict, buffers: dict, owner: bool = False) -> None:
+        '''
+        Use SharedPanel.create() or SharedPanel.attach()
+        '''
+        self.spec = spec
+        self._buffers = buffers
+        self._owner = owner
+        self.tickers = spec['tickers']
+        self.index = {ticker: row for row, ticker in enumerate(self.tickers)}
+        self.offsets = np.asarray(spec['offsets'], dtype=np.int64)
+        self.starts = np.asarray(spec['starts'], dtype=np.int64)
+        self.freq = spec['freq']
+        self.values = self._array('values')
+        self.output = self._array('output') # (tickers, horizon, [mean, lower, upper])
+        self.params = self._array('params')
+
+    def __repr__(self) -> str:
+        return f'SharedPanel(tickers={len(self)}, values={len(self.values)}, nbytes={self.nbytes})'
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.output.nbytes + self.params.nbytes
+
+    @classmethod
+    def create(cls, series: dict, horizon: int, n_params: int = 16, path: str = None) -> 'SharedPanel':
+        '''
+        Copies the series of a universe into a new shared panel and allocates the output arrays
+        Parameters:
+            series (dict) : ticker -> pd.Series or single column pd.DataFrame with a period index, all of the same frequency
+            horizon (int) : number of forecast steps of the output
+            n_params (int) : maximum number of model parameters of the output
+            path (str) : if specified, the arrays are memory-mapped files with this prefix instead of shared memory
+        '''
+        tickers = list(series)
+        lengths = np.array([len(ts) for ts in series.values()], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        first = next(iter(series.values())).index
+        spec = {
+            'tickers': tickers,
+            'offsets': offsets.tolist(),
+            'starts': [ts.index[0].ordinal for ts in series.values()],
+            'freq': first.freqstr,
+            'path': path,
+            'arrays': {
+                'values': ((int(offsets[-1]),), 'float64'),
+                'output': ((len(tickers), horizon, 3), 'float64'),
+                'params': ((len(tickers), n_params), 'float64'),
+            },
+        }
+        buffers = {}
+        for name, (shape, dtype) in spec['arrays'].items():
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if path is None:
+                memory = shared_memory.SharedMemory(create=True, size=nbytes)
+                spec.setdefault('names', {})[name] = memory.name
+                buffers[name] = memory
+            else:
+                buffers[name] = np.lib.format.open_memmap(f'{path}.{name}.npy', mode='w+', dtype=dtype, shape=shape)
+        panel = cls(spec, buffers, owner=True)
+        for row, ts in enumerate(series.values()):
+            panel.values[offsets[row]:offsets[row+1]] = np.asarray(ts, dtype=np.float64).ravel()
+        panel.output[:] = np.nan
+        panel.params[:] = np.nan
+        return panel
+
+    @classmethod
+    def attach(cls, spec: dict) -> 'SharedPanel':
+        '''
+        Attaches to a panel created in another process from its spec, which is small and cheap to pickle
+        '''
+        buffers = {}
+        for name in spec['arrays']:
+            if spec['path'] is None:
+                buffers[name] = shared_memory.SharedMemory(name=spec['names'][name])
+            else:
+                buffers[name] = np.load(f"{spec['path']}.{name}.npy", mmap_mode='r+')
+        return cls(spec, buffers)
+
+    def _array(self, name: str) -> np.ndarray:
+        shape, dtype = self.spec['arrays'][name]
+        buffer = self._buffers[name]
+        if isinstance(buffer, np.ndarray):
+            return buffer
+        return np.ndarray(shape, dtype=dtype, buffer=buffer.buf)
+
+    def view(self, row: Any) -> np.ndarray:
+        '''
+        Returns:
+            zero-copy view of the values of a ticker (or row number)
+        '''
+        row = self.index[row] if isinstance(row, str) else row
+        return self.values[self.offsets[row]:self.offsets[row+1]]
+
+    def series(self, row: Any) -> pd.Series:
+        '''
+        Returns:
+            values of a ticker (or row number) as a series with its period index, backed by the shared memory
+        '''
+        row = self.index[row] if isinstance(row, str) else row
+        values = self.view(row)
+        index = pd.period_range(start=pd.Period(ordinal=int(self.starts[row]), freq=self.freq), periods=len(values), freq=self.freq)
+        return pd.Series(values, index=index, copy=False)
+
+    def close(self) -> None:
+        '''
+        Detaches from the panel, the creator also frees the shared memory.
+        Views of the panel must not be used afterwards
+        '''
+        self.values = self.output = self.params = None
+        for buffer in self._buffers.values():
+            if isinstance(buffer, shared_memory.SharedMemory):
+                buffer.close()
+                if self._owner:
+                    buffer.unlink()
+            else:
+                buffer.flush()
+        self._buffers = {}
@@ -0,0 +1,196 @@
+from typing import Any
+import pandas as pd
+import numpy as np
+from modules.utils import logger
+
+class SimilarityIndex():
+    '''
+    Nearest neighbour search over the shapes of price or forecast windows.
+    Every window is resampled to the same length and z-normalized, so the squared euclidean distance of two
+    windows is 2 * window * (1 - correlation) and the search is a single matrix product over the universe.
+    For large universes the windows can be partitioned by a coarse k-means quantizer, queries then only
+    score the members of the closest partitions
+    '''
+    def __init__(self, window: int = 52, capacity: int = 64, dtype: Any = np.float32) -> None:
+        '''
+        Parameters:
+            window (int) : number of points of the indexed windows, longer or shorter series are resampled
+            capacity (int) : initial number of tickers, the arrays are grown when more are inserted
+            dtype : dtype of the stored windows
+        '''
+        self.window = window
+        self.index = {}
+        self.labels = []
+        self.vectors = np.zeros((capacity, window), dtype=dtype)
+        self.centroids = None
+        self.assignments = np.full(capacity, -1, dtype=np.int32)
+
+    def __repr__(self) -> str:
+        partitions = 0 if self.centroids is None else len(self.centroids)
+        return f'SimilarityIndex(tickers={len(self)}, window={self.window}, partitions={partitions})'
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self.index
+
+    @classmethod
+    def from_prices(cls, close: pd.DataFrame, window: int = 52, **kwargs) -> 'SimilarityIndex':
+        '''
+        Indexes the last window of prices of every ticker
+        Parameters:
+            close (pd.DataFrame) : prices with dates as the index and tickers as the columns
+            window (int) : number of periods of the windows
+        '''
+        index = cls(window, capacity=max(len(close.columns), 1), **kwargs)
+        index.add(close.iloc[-window:])
+        return index
+
+    @classmethod
+    def from_forecaster(cls, forecaster: Any, source: str = 'forecast', window: int = 52, **kwargs) -> 'SimilarityIndex':
+        '''
+        Indexes the forecasts or the past prices of the tickers of a Forecaster
+        Parameters:
+            forecaster (Forecaster) : forecaster with stored results
+            source (str) : 'forecast' for the forecast trajectories or 'price' for the last window of past prices
+            window (int) : number of points of the windows
+        '''
+        index = cls(window, **kwargs)
+        index.add(index._series_of(forecaster, source))
+        return index
+
+    def add(self, series: Any) -> None:
+        '''
+        Inserts or replaces the windows of tickers, e.g. as new forecasts land.
+        If the index is partitioned, the windows are assigned to their closest partition
+        Parameters:
+            series (pd.DataFrame or dict) : dataframe with tickers as the columns or dictionary of ticker -> values
+        '''
+        items = series.items() if isinstance(series, (pd.DataFrame, dict)) else series
+        tickers, windows = [], []
+        for ticker, values in items:
+            window = self._prepare(values)
+            if window is None:
+                logger.info(f'Skipped {ticker}, not enough values to index')
+                continue
+            tickers.append(ticker)
+            windows.append(window)
+        if not tickers:
+            return
+
+        rows = np.empty(len(tickers), dtype=int)
+        for i, ticker in enumerate(tickers):
+            if ticker not in self.index:
+                self.index[ticker] = len(self.labels)
+                self.labels.append(ticker)
+            rows[i] = self.index[ticker]
+        self._reserve(len(self.labels))
+        windows = np.vstack(windows)
+        self.vectors[rows] = windows
+        if self.centroids is not None:
+            self.assignments[rows] = np.argmax(windows @ self.centroids.T, axis=1)
+
+    def partition(self, n_clusters: int = None, iterations: int = 10, seed: int = 42) -> None:
+        '''
+        Builds the coarse quantizer with k-means over the indexed windows.
+        As all windows have the same norm, the closest centroid is the one with the largest dot product
+        Parameters:
+            n_clusters (int) : number of partitions, defaults to the square root of the number of tickers
+            iterations (int) : number of k-means iterations
+            seed (int) : seed of the initial centroids
+        '''
+        n = len(self)
+        n_clusters = min(n_clusters or max(int(np.sqrt(n)), 1), n)
+        vectors = self.vectors[:n]
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n, n_clusters, replace=False)].astype(np.float64)
+        for _ in range(iterations):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=n_clusters)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self.centroids = centroids.astype(self.vectors.dtype)
+        self.assignments[:n] = np.argmax(vectors @ self.centroids.T, axis=1)
+        logger.info(f'Partitioned {n} windows into {n_clusters} partitions')
+
+    def query(self, query: Any, k: int = 10, candidates: list = None, n_probe: int = None) -> pd.DataFrame:
+        '''
+        Finds the tickers with the most similar windows
+        Parameters:
+            query (str or array-like) : indexed ticker, or values of a window to search for
+            k (int) : number of neighbours
+            candidates (list) : tickers to search within, e.g. the members of a cluster of the segment analysis
+            n_probe (int) : number of closest partitions to search if the index is partitioned, None for an exact search
+        Returns:
+            pd.DataFrame indexed by ticker with 'distance' and 'correlation', sorted by distance.
+            A ticker used as the query is excluded from its own neighbours
+        '''
+        exclude = None
+        if isinstance(query, str):
+            exclude = self.index[query]
+            vector = self.vectors[exclude]
+        else:
+            vector = self._prepare(query)
+            if vector is None:
+                raise ValueError('Query has not enough values')
+
+        n = len(self)
+        rows = np.arange(n)
+        if candidates is not None:
+            rows = np.array([self.index[ticker] for ticker in candidates if ticker in self.index], dtype=int)
+        if n_probe is not None and self.centroids is not None:
+            probed = np.argsort(self.centroids @ vector)[::-1][:n_probe]
+            rows = rows[np.isin(self.assignments[rows], probed)]
+        if exclude is not None:
+            rows = rows[rows != exclude]
+
+        dots = self.vectors[rows] @ vector
+        k = min(k, len(rows))
+        top = np.argpartition(-dots, k - 1)[:k] if 0 < k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-dots[top])]
+        correlation = np.clip(dots[top] / self.window, -1, 1)
+        return pd.DataFrame({'distance': np.sqrt(2 * self.window * (1 - correlation)), 'correlation': correlation},
+                            index=pd.Index([self.labels[row] for row in rows[top]], name='Ticker'))
+
+    def _prepare(self, values: Any) -> np.ndarray:
+        '''
+        Resamples a series to the window length and z-normalizes it, None if it has less than 2 values.
+        Constant series are indexed as zeros, which are equally far from every other window
+        '''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) < 2:
+            return None
+        if len(values) != self.window:
+            values = np.interp(np.linspace(0, len(values) - 1, self.window), np.arange(len(values)), values)
+        std = values.std()
+        window = (values - values.mean()) / std if std > 0 else np.zeros(self.window)
+        return window.astype(self.vectors.dtype)
+
+    def _series_of(self, forecaster: Any, source: str) -> dict:
+        series = {}
+        for ticker, data in forecaster.tickers.items():
+            if source == 'forecast':
+                values = forecaster._forecast_of(ticker)
+            else:
+                values = (data or {}).get('ts', None)
+                values = None if values is None else values.iloc[-self.window:]
+            if values is not None:
+                series[ticker] = values
+        return series
+
+    def _reserve(self, capacity: int) -> None:
+        '''
+        Grows the arrays to hold at least the given number of tickers
+        '''
+        if capacity <= len(self.vectors):
+            return
+        capacity = max(capacity, 2 * len(self.vectors))
+        vectors = np.zeros((capacity, self.window), dtype=self.vectors.dtype)
+        vectors[:len(self.vectors)] = self.vectors
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        assignments[:len(self.assignments)] = self.assignments
+        self.vectors, self.assignments = vectors, assignments
@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+from modules.snapshots import load_snapshot, normalize_metric, resolve_metric, snapshot_dates, SNAPSHOT_PATTERN
+from modules.utils import logger
+
+class SnapshotDiff():
+    '''
+    Compares statistics snapshots across dates.
+    The snapshots are aligned once into a (dates x tickers x metrics) array over the union of tickers
+    and the metrics common to all snapshots, changes are then computed as array operations
+    '''
+    def __init__(self, snapshots: dict) -> None:
+        '''
+        Parameters:
+            snapshots (dict) : date -> snapshot indexed by ticker (see snapshots.load_snapshot), at least two
+        '''
+        if len(snapshots) < 2:
+            raise ValueError('At least two snapshots are required for a comparison')
+        snapshots = dict(sorted(snapshots.items()))
+        frames = []
+        for df in snapshots.values():
+            df = df.apply(pd.to_numeric, errors='coerce')
+            df.columns = [normalize_metric(col) for col in df.columns]
+            frames.append(df.loc[:, df.notna().any()]) # Drops text and date columns
+
+        self.dates = list(snapshots)
+        self.tickers = np.array(sorted(set().union(*[df.index for df in frames])), dtype=str)
+        self.metrics = [col for col in frames[0].columns if all(col in df.columns for df in frames[1:])]
+        self.values = np.stack([df.reindex(index=self.tickers, columns=self.metrics).to_numpy(dtype=np.float64) for df in frames])
+        self.present = np.stack([np.isin(self.tickers, df.index.to_numpy(dtype=str)) for df in frames])
+        logger.info(f'Aligned {len(self.dates)} snapshots, {len(self.tickers)} tickers and {len(self.metrics)} metrics')
+
+    def __repr__(self) -> str:
+        return f'SnapshotDiff(dates={self.dates}, tickers={len(self.tickers)}, metrics={len(self.metrics)})'
+
+    @classmethod
+    def from_files(cls, pattern: str = SNAPSHOT_PATTERN) -> 'SnapshotDiff':
+        '''
+        Loads all the dated snapshots matching a glob pattern, e.g. 'data/s&p_*.csv'
+        '''
+        return cls({date: load_snapshot(filepath) for date, filepath in snapshot_dates(pattern).items()})
+
+    def change(self, old: str = None, new: str = None, relative: bool = False) -> np.ndarray:
+        '''
+        Computes the change of every metric between two snapshots
+        Parameters:
+            old (str) : date of the older snapshot, defaults to the first
+            new (str) : date of the newer snapshot, defaults to the last
+            relative (bool) : whether to return the change in % of the old value
+        Returns:
+            np.ndarray of shape (tickers, metrics), NaN for tickers missing in either snapshot
+        '''
+        old_values, new_values = self.values[self._position(old, 0)], self.values[self._position(new, -1)]
+        change = new_values - old_values
+        if relative:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = np.where(old_values != 0, change / np.abs(old_values) * 100, np.nan)
+        return change
+
+    def diff(self, old: str = None, new: str = None, relative: bool = False) -> pd.DataFrame:
+        '''
+        Returns:
+            change of every metric for the tickers present in both snapshots, see documentation on change()
+        '''
+        rows = self.present[self._position(old, 0)] & self.present[self._position(new, -1)]
+        return pd.DataFrame(self.change(old, new, relative)[rows], index=pd.Index(self.tickers[rows], name='Ticker'), columns=self.metrics)
+
+    def history(self, metric: str, relative: bool = False) -> pd.DataFrame:
+        '''
+        Computes the change of a metric between every consecutive pair of snapshots
+        Returns:
+            pd.DataFrame of tickers x 'old -> new' date pairs
+        '''
+        values = self.values[..., self.metrics.index(resolve_metric(metric, self.metrics))]
+        change = np.diff(values, axis=0)
+        if relative:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                change = np.where(values[:-1] != 0, change / np.abs(values[:-1]) * 100, np.nan)
+        columns = [f'{old} -> {new}' for old, new in zip(self.dates[:-1], self.dates[1:])]
+        return pd.DataFrame(change.T, index=pd.Index(self.tickers, name='Ticker'), columns=columns)
+
+    def added(self, old: str = None, new: str = None) -> list:
+        '''
+        Returns:
+            tickers in the newer snapshot which are not in the older snapshot
+        '''
+        return self.tickers[self.present[self._position(new, -1)] & ~self.present[self._position(old, 0)]].tolist()
+
+    def removed(self, old: str = None, new: str = None) -> list:
+        '''
+        Returns:
+            tickers in the older snapshot which are not in the newer snapshot
+        '''
+        return self.tickers[self.present[self._position(old, 0)] & ~self.present[self._position(new, -1)]].tolist()
+
+    def constituent_changes(self) -> pd.DataFrame:
+        '''
+        Returns:
+            pd.DataFrame of the added and removed tickers between every consecutive pair of snapshots
+        '''
+        added = self.present[1:] & ~self.present[:-1]
+        removed = self.present[:-1] & ~self.present[1:]
+        return pd.DataFrame({
+            'added': [self.tickers[row].tolist() for row in added],
+            'removed': [self.tickers[row].tolist() for row in removed],
+        }, index=[f'{old} -> {new}' for old, new in zip(self.dates[:-1], self.dates[1:])])
+
+    def top_movers(self, metric: str, n: int = 10, old: str = None, new: str = None, relative: bool = True, ascending: bool = False) -> pd.DataFrame:
+        '''
+        Finds the tickers with the largest change of a metric between two snapshots
+        Parameters:
+            metric (str) : metric to compare
+            n (int) : number of tickers
+            old, new, relative (see documentation on change())
+            ascending (bool) : whether to return the largest decreases instead of increases
+        Returns:
+            pd.DataFrame of the old and new values, absolute and relative changes
+        '''
+        col = self.metrics.index(resolve_metric(metric, self.metrics))
+        i, j = self._position(old, 0), self._position(new, -1)
+        old_values, new_values = self.values[i, :, col], self.values[j, :, col]
+        absolute = new_values - old_values
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.where(old_values != 0, absolute / np.abs(old_values) * 100, np.nan)
+
+        key = percent if relative else absolute
+        key = np.where(np.isnan(key), np.inf if ascending else -np.inf, key)
+        n = min(n, len(key))
+        rows = np.argpartition(key, n-1)[:n] if ascending else np.argpartition(-key, n-1)[:n]
+        rows = rows[np.argsort(key[rows] if ascending else -key[rows], kind='stable')]
+        rows = rows[~np.isnan(absolute[rows])]
+        return pd.DataFrame({
+            self.dates[i]: old_values[rows],
+            self.dates[j]: new_values[rows],
+            'change': absolute[rows],
+            'change %': percent[rows],
+        }, index=pd.Index(self.tickers[rows], name='Ticker'))
+
+    def _position(self, date: str, default: int) -> int:
+        if date is None:
+            return default % len(self.dates)
+        return self.dates.index(date)
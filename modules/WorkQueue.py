@@ -0,0 +1,357 @@
+'''
+Durable work queue on a SQLite file, shared by any number of worker processes.
+By default the file is in WAL mode, which only works for processes on one host as it relies on shared memory.
+With shared=True (--shared) the file uses a rollback journal instead, so workers on other hosts can use it over a
+network filesystem, provided the filesystem implements file locks correctly (many NFS and SMB setups do not,
+see https://www.sqlite.org/useovernet.html). Where they do not, a broker has to replace this queue.
+
+Usage (from the repository root), one or more workers per host:
+    python -m modules.WorkQueue data/queue.sqlite
+    python -m modules.WorkQueue data/queue.sqlite --kinds forecast --wait
+    python -m modules.WorkQueue /mnt/shared/queue.sqlite --shared
+'''
+import io
+import os
+import json
+import time
+import base64
+import threading
+import socket
+import sqlite3
+import hashlib
+import argparse
+from contextlib import closing
+from typing import Any
+import pandas as pd
+import numpy as np
+from modules.utils import logger, append_log
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, kind, lease_expires);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    result BLOB,
+    completed REAL
+);
+'''
+
+class WorkQueue():
+    '''
+    Tasks are (kind, payload) pairs identified by a hash of both, so publishing the same task twice is a no-op.
+    Workers claim tasks under a lease, a task whose lease expired (e.g. its worker crashed) can be claimed again.
+    Results are keyed by the task, so a task completed twice writes the same result once.
+    Workers renew the lease of the task they run, so only tasks of workers which stopped are claimed again.
+    Results are stored as data only (json, and parquet for dataframes, see encode_result()), never pickled,
+    so a process able to write the queue file cannot run code in the processes reading the results
+    '''
+    def __init__(self, path: str = 'data/queue.sqlite', lease_seconds: float = 600, max_attempts: int = 3, shared: bool = False) -> None:
+        '''
+        Parameters:
+            path (str) : sqlite file of the queue, created if it does not exist
+            lease_seconds (float) : time a worker has to renew the lease of a claimed task before it can be claimed again
+            max_attempts (int) : number of claims of a task before it is marked as failed
+            shared (bool) : whether workers on other hosts use the file, see the module documentation.
+                Every process using the file must use the same setting
+        '''
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.shared = shared
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def __repr__(self) -> str:
+        return f'WorkQueue(path={self.path}, {self.stats()})'
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        # WAL needs the shared memory of one host, a rollback journal only needs file locks
+        conn.execute(f"PRAGMA journal_mode={'DELETE' if self.shared else 'WAL'}")
+        return conn
+
+    @staticmethod
+    def task_key(kind: str, payload: dict) -> str:
+        '''
+        Returns:
+            hash identifying a task, independent of the order of the payload keys
+        '''
+        return hashlib.sha1(f'{kind}:{json.dumps(payload, sort_keys=True)}'.encode()).hexdigest()
+
+    def publish(self, kind: str, payloads: list) -> list:
+        '''
+        Adds tasks to the queue, tasks which were already published are left as they are
+        Parameters:
+            kind (str) : type of the tasks, e.g. 'forecast' or 'stats'
+            payloads (list) : json serializable dictionaries of the task parameters
+        Returns:
+            list of the task keys
+        '''
+        now = time.time()
+        rows = [(kind, self.task_key(kind, payload), json.dumps(payload, sort_keys=True), now) for payload in payloads]
+        with closing(self._connect()) as conn:
+            conn.executemany('INSERT OR IGNORE INTO tasks (kind, key, payload, updated) VALUES (?, ?, ?, ?)', rows)
+        logger.info(f'Published {len(rows)} {kind} tasks')
+        return [row[1] for row in rows]
+
+    def claim(self, worker: str, kinds: list = None, limit: int = 1) -> list:
+        '''
+        Leases pending tasks, or tasks with an expired lease, to a worker
+        Parameters:
+            worker (str) : name of the worker
+            kinds (list) : types of tasks the worker can run, defaults to all
+            limit (int) : maximum number of tasks to claim
+        Returns:
+            list of (task id, kind, payload)
+        '''
+        now = time.time()
+        kind_filter = f"AND kind IN ({','.join('?' * len(kinds))})" if kinds else ''
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE') # Locks the queue so two workers never claim the same task
+            # Tasks which expired too many times are given up on
+            conn.execute("UPDATE tasks SET status = 'failed', error = 'lease expired', updated = ? "
+                         "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, self.max_attempts))
+            rows = conn.execute(f"SELECT id, kind, payload FROM tasks WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) "
+                                f"{kind_filter} ORDER BY id LIMIT ?", (now, *(kinds or []), limit)).fetchall()
+            conn.executemany("UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                             [(worker, now + self.lease_seconds, now, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return [(task_id, kind, json.loads(payload)) for task_id, kind, payload in rows]
+
+    def extend(self, task_id: int, worker: str) -> bool:
+        '''
+        Renews the lease of a long running task
+        Returns:
+            whether the worker still held the lease
+        '''
+        now = time.time()
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("UPDATE tasks SET lease_expires = ?, updated = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                                  (now + self.lease_seconds, now, task_id, worker))
+        return cursor.rowcount == 1
+
+    def _heartbeat(self, task_id: int, worker: str, stop: threading.Event) -> None:
+        '''
+        Renews the lease of a running task every third of the lease until stopped, or until the lease was lost
+        '''
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.extend(task_id, worker):
+                    logger.info(f'Worker {worker} lost the lease of task {task_id}')
+                    return
+            except sqlite3.Error as e:
+                logger.info(f'Lease renewal of task {task_id} failed: {e!r}') # Retried on the next beat
+
+    def complete(self, task_id: int, worker: str, result: Any) -> None:
+        '''
+        Stores the result of a task and marks it as done.
+        Only the first result of a task is kept, e.g. when a worker whose lease expired still completes it
+        '''
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            kind, key = conn.execute('SELECT kind, key FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            conn.execute('INSERT OR IGNORE INTO results (key, kind, result, completed) VALUES (?, ?, ?, ?)',
+                         (key, kind, encode_result(result), now))
+            conn.execute("UPDATE tasks SET status = 'done', owner = ?, lease_expires = NULL, error = NULL, updated = ? WHERE id = ?",
+                         (worker, now, task_id))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def fail(self, task_id: int, worker: str, error: str) -> None:
+        '''
+        Releases a task after an error, it is retried until max_attempts claims
+        '''
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                         "owner = NULL, lease_expires = NULL, error = ?, updated = ? WHERE id = ? AND owner = ?",
+                         (self.max_attempts, error, time.time(), task_id, worker))
+
+    def results(self, keys: list) -> dict:
+        '''
+        Returns:
+            dictionary of task key -> result, for the completed tasks only
+        '''
+        results = {}
+        with closing(self._connect()) as conn:
+            for i in range(0, len(keys), 500): # Stays under the sqlite limit of query parameters
+                chunk = keys[i:i+500]
+                rows = conn.execute(f"SELECT key, result FROM results WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                results.update((key, decode_result(result)) for key, result in rows)
+        return results
+
+    def pending(self, keys: list) -> int:
+        '''
+        Returns:
+            number of the tasks which are neither done nor failed
+        '''
+        count = 0
+        with closing(self._connect()) as conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i+500]
+                count += conn.execute(f"SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased') "
+                                      f"AND key IN ({','.join('?' * len(chunk))})", chunk).fetchone()[0]
+        return count
+
+    def join(self, keys: list, poll: float = 1.0) -> None:
+        '''
+        Waits until the tasks are done or failed
+        '''
+        while self.pending(keys):
+            time.sleep(poll)
+
+    def stats(self) -> dict:
+        '''
+        Returns:
+            dictionary of status -> number of tasks
+        '''
+        with closing(self._connect()) as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def work(self, handlers: dict, worker: str = None, wait: bool = False, poll: float = 1.0, keys: list = None) -> int:
+        '''
+        Worker loop, claims tasks and runs them with the handler of their kind until the queue is empty
+        Parameters:
+            handlers (dict) : kind -> function of the payload returning the result
+            worker (str) : name of the worker, defaults to host:pid
+            wait (bool) : whether to keep polling for new tasks when the queue is empty
+            poll (float) : seconds between polls of an empty queue
+            keys (list) : if specified, stops once these tasks are done or failed, e.g. to work on a published batch
+        Returns:
+            number of tasks completed by this worker
+        '''
+        worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+        done = 0
+        while True:
+            tasks = self.claim(worker, kinds=list(handlers))
+            if not tasks:
+                if keys is not None and not self.pending(keys):
+                    break
+                if keys is None and not wait:
+                    break
+                time.sleep(poll) # Remaining tasks are leased by other workers
+                continue
+            for task_id, kind, payload in tasks:
+                stop = threading.Event()
+                heartbeat = threading.Thread(target=self._heartbeat, args=(task_id, worker, stop), daemon=True)
+                heartbeat.start()
+                try:
+                    result = handlers[kind](payload)
+                except Exception as e:
+                    logger.info(f'Task {task_id} ({kind}) failed: {e!r}')
+                    self.fail(task_id, worker, repr(e))
+                    continue
+                finally:
+                    stop.set()
+                    heartbeat.join()
+                self.complete(task_id, worker, result)
+                done += 1
+        logger.info(f'Worker {worker} completed {done} tasks')
+        return done
+
+def _encode(obj: Any) -> Any:
+    '''
+    Converts a result into json serializable data, pandas objects are tagged so they can be rebuilt
+    '''
+    if isinstance(obj, dict):
+        return {str(key): _encode(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(value) for value in obj]
+    if isinstance(obj, pd.Period):
+        return {'__period__': int(obj.ordinal), 'freq': obj.freqstr}
+    if isinstance(obj, (pd.Series, pd.DataFrame)) and isinstance(obj.index, pd.PeriodIndex):
+        frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+        return {'__periods__': obj.index.asi8.tolist(), 'freq': obj.index.freqstr, 'series': isinstance(obj, pd.Series),
+                'name': _encode(obj.name) if isinstance(obj, pd.Series) else None, 'columns': [str(col) for col in frame.columns],
+                'values': frame.to_numpy(dtype=np.float64).tolist()}
+    if isinstance(obj, pd.Series):
+        return {'__series__': obj.to_numpy(dtype=np.float64).tolist(), 'index': [str(label) for label in obj.index], 'name': _encode(obj.name)}
+    if isinstance(obj, pd.DataFrame):
+        buffer = io.BytesIO()
+        obj.to_parquet(buffer)
+        return {'__parquet__': base64.b64encode(buffer.getvalue()).decode('ascii')}
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    raise TypeError(f'Results of type {type(obj).__name__} cannot be stored in the queue')
+
+def _decode(data: Any) -> Any:
+    if isinstance(data, list):
+        return [_decode(value) for value in data]
+    if not isinstance(data, dict):
+        return data
+    if '__period__' in data:
+        return pd.Period(ordinal=data['__period__'], freq=data['freq'])
+    if '__periods__' in data:
+        index = pd.PeriodIndex.from_ordinals(data['__periods__'], freq=data['freq'])
+        frame = pd.DataFrame(np.array(data['values'], dtype=np.float64).reshape(len(index), len(data['columns'])),
+                             index=index, columns=data['columns'])
+        return frame.iloc[:, 0].rename(_decode(data['name'])) if data['series'] else frame
+    if '__series__' in data:
+        return pd.Series(data['__series__'], index=data['index'], name=_decode(data['name']), dtype=np.float64)
+    if '__parquet__' in data:
+        return pd.read_parquet(io.BytesIO(base64.b64decode(data['__parquet__'])))
+    return {key: _decode(value) for key, value in data.items()}
+
+def encode_result(result: Any) -> bytes:
+    '''
+    Serializes a task result as json, see WorkQueue
+    Returns:
+        utf-8 json, with period indexed series and dataframes as values, period ordinals and frequency,
+        other series as float values and labels, and other dataframes as base64 parquet
+    '''
+    return json.dumps(_encode(result)).encode('utf-8')
+
+def decode_result(data: bytes) -> Any:
+    '''
+    Rebuilds a task result serialized by encode_result()
+    '''
+    return _decode(json.loads(data))
+
+def main() -> None:
+    from modules.Forecaster import Forecaster
+    from modules.YfScrapper import YfScrapper
+
+    parser = argparse.ArgumentParser(description='Runs a worker of the forecasting and scraping work queue')
+    parser.add_argument('path', nargs='?', default='data/queue.sqlite', help='sqlite file of the queue')
+    parser.add_argument('--kinds', nargs='+', default=['forecast', 'stats'], help='types of tasks to run')
+    parser.add_argument('--wait', action='store_true', help='keep polling for new tasks when the queue is empty')
+    parser.add_argument('--lease', type=float, default=600, help='seconds to renew the lease of a task before it can be claimed again')
+    parser.add_argument('--shared', action='store_true', help='the queue file is used by workers on other hosts')
+    args = parser.parse_args()
+
+    append_log() # Workers share the log of the app on their host
+    handlers = {'forecast': Forecaster().run_task, 'stats': YfScrapper().run_task}
+    queue = WorkQueue(args.path, lease_seconds=args.lease, shared=args.shared)
+    queue.work({kind: handlers[kind] for kind in args.kinds}, wait=args.wait)
+
+if __name__ == '__main__':
+    main()
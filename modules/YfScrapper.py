@@ -1,14 +1,51 @@
+import os
 import re
 from typing import Any
 import requests
 import pandas as pd
 import numpy as np
 from bs4 import BeautifulSoup
-from datetime import datetime
+from datetime import datetime, date
 from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
 from collections.abc import Iterable 
+from modules.prices import load_price_panel
+from modules.technicals import technical_metrics
+from modules.dataset import DATASET_ROOT, statistics_table, write_dataset
+from modules.HtmlCache import HtmlCache
 from modules.utils import logger
 
+# Mapping of the metrics on the yahoo statistics page to column names with units
+MAPPING_DICT = {
+    'Market Cap (intraday)' : 'Market Cap (B)',
+    'Enterprise Value' : 'Enterprise Value (B)',
+    '52-Week Change' : '52 Week Change (%)',
+    'S&P500 52-Week Change': 'S&P500 52-Week Change (%)',
+    'Avg Vol 3 month' : 'Avg Vol 3 month (B)',
+    'Avg Vol (10 day)' : 'Avg Vol 10 day (B)',
+    'Shares Short' : 'Shares Short (M) (prior month)',
+    'Forward Annual Dividend Yield': 'Forward Annual Dividend Yield (%)',
+    'Trailing Annual Dividend Yield' : 'Trailing Annual Dividend Yield (%)',
+    'Payout Ratio' : 'Payout Ratio (%)',
+    'Last Split Factor' : 'Last Split Factor (x:1)',
+    'Profit Margin' : 'Profit Margin (%)',
+    'Operating Margin (ttm)' : 'Operating Margin (ttm) (%)',
+    'Return on Assets (ttm)' : 'Return on Assets (ttm) (%)',
+    'Return on Equity (ttm)' : 'Return on Equity (ttm) (%)',
+    'Revenue (ttm)' : 'Revenue (ttm) (B)',
+    'Quarterly Revenue Growth (yoy)' : 'Quarterly Revenue Growth (yoy) (%)',
+    'Gross Profit (ttm)' : 'Gross Profit (ttm) (B)',
+    'EBITDA' : 'EBITDA (B)',
+    'Net Income Avi to Common (ttm)' : 'Net Income Avi to Common (ttm) (B)',
+    'Quarterly Earnings Growth (yoy)' : 'Quarterly Earnings Growth (yoy) (%)',
+    'Total Cash (mrq)' :'Total Cash (mrq) (B)',
+    'Total Debt (mrq)' :'Total Debt (mrq) (B)',
+    'Operating Cash Flow (ttm)' : 'Operating Cash Flow (ttm) (B)',
+    'Levered Free Cash Flow (ttm)' : 'Levered Free Cash Flow (ttm) (B)'
+}
+
+STATS_URL = 'https://finance.yahoo.com/quote/{ticker}/key-statistics?p={ticker}'
+
 class YfScrapper():
     '''
     Scrapper object to get data from Yahoo Finance, can contain multiple data for different tickers
@@ -24,35 +61,10 @@ class YfScrapper():
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1'
             }
-        self.mapping_dict = {
-            'Market Cap (intraday)' : 'Market Cap (B)',
-            'Enterprise Value' : 'Enterprise Value (B)',
-            '52-Week Change' : '52 Week Change (%)',
-            'S&P500 52-Week Change': 'S&P500 52-Week Change (%)',
-            'Avg Vol 3 month' : 'Avg Vol 3 month (B)',
-            'Avg Vol (10 day)' : 'Avg Vol 10 day (B)',
-            'Shares Short' : 'Shares Short (M) (prior month)',
-            'Forward Annual Dividend Yield': 'Forward Annual Dividend Yield (%)',
-            'Trailing Annual Dividend Yield' : 'Trailing Annual Dividend Yield (%)',
-            'Payout Ratio' : 'Payout Ratio (%)',
-            'Last Split Factor' : 'Last Split Factor (x:1)',
-            'Profit Margin' : 'Profit Margin (%)',
-            'Operating Margin (ttm)' : 'Operating Margin (ttm) (%)',
-            'Return on Assets (ttm)' : 'Return on Assets (ttm) (%)',
-            'Return on Equity (ttm)' : 'Return on Equity (ttm) (%)',
-            'Revenue (ttm)' : 'Revenue (ttm) (B)',
-            'Quarterly Revenue Growth (yoy)' : 'Quarterly Revenue Growth (yoy) (%)',
-            'Gross Profit (ttm)' : 'Gross Profit (ttm) (B)',
-            'EBITDA' : 'EBITDA (B)',
-            'Net Income Avi to Common (ttm)' : 'Net Income Avi to Common (ttm) (B)',
-            'Quarterly Earnings Growth (yoy)' : 'Quarterly Earnings Growth (yoy) (%)',
-            'Total Cash (mrq)' :'Total Cash (mrq) (B)',
-            'Total Debt (mrq)' :'Total Debt (mrq) (B)',
-            'Operating Cash Flow (ttm)' : 'Operating Cash Flow (ttm) (B)',
-            'Levered Free Cash Flow (ttm)' : 'Levered Free Cash Flow (ttm) (B)'
-        }
+        self.mapping_dict = dict(MAPPING_DICT)
         self.tickers = {}
         self.compiled_dataframes = None
+        self.cache = None # HtmlCache of the raw pages, see use_cache()
 
     def __getattr__(self, ticker: str) -> Any:
         '''
@@ -102,7 +114,7 @@ class YfScrapper():
             '''Helper function to map or return original values'''
             return self.mapping_dict.get(row, row)
 
-    def get_ticker_stats(self, tickers, clean_df=True):  
+    def get_ticker_stats(self, tickers, clean_df=True, queue=None, work=True):  
         '''
         Function take takes in a list of tickers and scraps the yahoo stats into a dictionary.
         Parameters:
@@ -110,6 +122,10 @@ class YfScrapper():
                 If 'all', will scrap for all the stored tickers, otherwise provide a list of tickers to scrap or a ticker
             clean_df (bool):
                 option whether to clean the data
+            queue (WorkQueue):
+                if specified, the pages are scraped as tasks of the work queue by its workers, see modules.WorkQueue
+            work (bool):
+                whether this process also works on the queued tasks, or only waits for other workers
         '''
         if isinstance(tickers, str):
             if tickers.upper() == 'ALL':
@@ -122,41 +138,178 @@ class YfScrapper():
             pass
         else:
             raise TypeError('tickers must be str or iterable list of strings')
+
+        if queue is not None:
+            self._get_ticker_stats_queued(queue, list(tickers), clean_df, work)
+            return
         
         for ticker in tickers:
-            url = f'https://finance.yahoo.com/quote/{ticker}/key-statistics?p={ticker}'
-            resp = requests.get(url, headers = self.headers)
-            # logger.info(f'{ticker} status - {resp.status_code}')
-            soup = BeautifulSoup(resp.text, "html.parser")
-            name = soup.find("h1").text
-
-            # Read the html using pandas to parse tables directly, then concatenate them
-            dfs = pd.read_html(StringIO(resp.text))
-            df = pd.concat([*dfs])
-            df.columns = ['metrics', ticker]
-            # Header cleaning
-            df['metrics'].replace(regex={r'[0-9]$': ''}, inplace = True) # Removes the annotations appearing at the end of rows
-            df['metrics'].replace(regex={r'(\(.+,.+\))': ''}, inplace = True) # This will specifically remove dates inside brackets, by checking for ','
-            
-            df['metrics'] = df['metrics'].str.strip()
-            df['metrics'] = df['metrics'].apply(self._mapper)
-            df = df.T
-            df.columns = df.iloc[0,:] # Update the first row as the header
-            df.insert(0, 'Name', name)
-            df = df.drop('metrics') # Drop the first row
-
-            # There are two columns named 'shares short', the latter is for prior month
-            idx = df.columns.to_list().index('Shares Short (M) (prior month)')
-            updated_columns = df.columns.to_list()
-            updated_columns[idx] = 'Shares Short (M)'
-
-            df.columns = updated_columns
-            if clean_df:
-                df = self.clean_df(df)
+            url = STATS_URL.format(ticker=ticker)
+            html = self._fetch_page(url)
+            df = self._parse_stats_page(ticker, html, clean_df=clean_df)
             logger.info(f'{df.iloc[0,0]} : {df.iloc[0,1]}')
             # Save to the object variable
             self.tickers[ticker] = df
 
+    def run_task(self, payload: dict) -> pd.DataFrame:
+        '''
+        Scrapes the statistics of a work queue task, see modules.WorkQueue
+        Parameters:
+            payload (dict) : 'ticker' and 'clean_df'
+        '''
+        ticker = payload['ticker']
+        html = self._fetch_page(STATS_URL.format(ticker=ticker))
+        return self._parse_stats_page(ticker, html, clean_df=payload['clean_df'])
+
+    def _get_ticker_stats_queued(self, queue, tickers: list, clean_df: bool, work: bool = True) -> None:
+        '''
+        Publishes one scraping task per ticker, works on them (or waits for other workers) and stores the results.
+        Tasks include the date, so scraping again on the same day reuses the pages already scraped
+        '''
+        payloads = [{'ticker': ticker, 'clean_df': clean_df, 'as_of': date.today().isoformat()} for ticker in tickers]
+        keys = queue.publish('stats', payloads)
+        if work:
+            queue.work({'stats': self.run_task}, keys=keys)
+        else:
+            queue.join(keys)
+        results = queue.results(keys)
+        for ticker, key in zip(tickers, keys):
+            if key in results:
+                self.tickers[ticker] = results[key]
+            else:
+                logger.info(f'Scraping task failed for {ticker}')
+
+    def _fetch_page(self, url: str) -> str:
+        '''
+        Retrieves the raw html of a page
+        Parameters:
+            url (str) : page to retrieve
+        Returns:
+            html text of the response
+        '''
+        if self.cache is not None:
+            html = self.cache.get(url, date.today().isoformat())
+            if html is not None:
+                return html
+        resp = requests.get(url, headers = self.headers)
+        # logger.info(f'{url} status - {resp.status_code}')
+        if self.cache is not None and resp.ok:
+            self.cache.put(url, resp.text)
+        return resp.text
+
+    def use_cache(self, cache: HtmlCache = None) -> HtmlCache:
+        '''
+        Stores every fetched page in a content addressed cache, pages already fetched today are served from it
+        Parameters:
+            cache (HtmlCache) : cache to use, defaults to one in data/cache/html
+        '''
+        self.cache = cache or HtmlCache()
+        return self.cache
+
+    def replay(self, fetch_date: str = None, tickers: list = None, clean_df: bool = True, workers: int = None) -> dict:
+        '''
+        Re-parses and cleans the cached statistics pages of a past scrape in parallel processes, without any request,
+        e.g. after the parsing or cleaning logic changed
+        Parameters:
+            fetch_date (str) : date of the scrape 'YYYY-MM-DD', defaults to the latest
+            tickers (list) : tickers to replay, defaults to all the cached statistics pages of that date
+            clean_df (bool) : option whether to clean the data
+            workers (int) : number of processes, defaults to the number of cpus
+        Returns:
+            dictionary of ticker -> pd.DataFrame, also saved into self.tickers
+        '''
+        cache = self.cache or HtmlCache()
+        entries = {url.rsplit('=', 1)[-1]: digest for url, digest in cache.entries(fetch_date).items() if '/key-statistics' in url}
+        if tickers is not None:
+            entries = {ticker: entries[ticker] for ticker in tickers if ticker in entries}
+        workers = workers or os.cpu_count() or 1
+        chunksize = max(len(entries) // (workers * 4), 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_replay, initargs=(self.mapping_dict, cache.root)) as executor:
+            results = executor.map(_replay_page, entries.items(), [clean_df] * len(entries), chunksize=chunksize)
+            dfs = {ticker: df for ticker, df in zip(entries, results) if df is not None}
+        self.tickers.update(dfs)
+        logger.info(f'Replayed {len(dfs)} of {len(entries)} cached pages')
+        return dfs
+
+    def _parse_stats_page(self, ticker: str, html: str, clean_df: bool=True) -> pd.DataFrame:
+        '''
+        Parses the html of a yahoo statistics page into a single row dataframe
+        Parameters:
+            ticker (str) : ticker of the page
+            html (str) : raw html of the statistics page
+            clean_df (bool) : option whether to clean the data
+        Returns:
+            pd.DataFrame with ticker as the index and metrics as the columns
+        '''
+        soup = BeautifulSoup(html, "html.parser")
+        name = soup.find("h1").text
+
+        # Read the html using pandas to parse tables directly, then concatenate them
+        dfs = pd.read_html(StringIO(html))
+        df = pd.concat([*dfs])
+        df.columns = ['metrics', ticker]
+        # Header cleaning
+        df['metrics'] = df['metrics'].replace(regex={r'[0-9]$': ''}) # Removes the annotations appearing at the end of rows
+        df['metrics'] = df['metrics'].replace(regex={r'(\(.+,.+\))': ''}) # This will specifically remove dates inside brackets, by checking for ','
+        
+        df['metrics'] = df['metrics'].str.strip()
+        df['metrics'] = df['metrics'].apply(self._mapper)
+        df = df.T
+        df.columns = df.iloc[0,:] # Update the first row as the header
+        df.insert(0, 'Name', name)
+        df = df.drop('metrics') # Drop the first row
+
+        # There are two columns named 'shares short', the latter is for prior month
+        idx = df.columns.to_list().index('Shares Short (M) (prior month)')
+        updated_columns = df.columns.to_list()
+        updated_columns[idx] = 'Shares Short (M)'
+
+        df.columns = updated_columns
+        if clean_df:
+            df = self.clean_df(df)
+        return df
+
+    def get_technical_stats(self, tickers='all', prices: dict = None, benchmark: str = '^GSPC', period: str = '5y') -> pd.DataFrame:
+        '''
+        Computes the price derived statistics (moving averages, 52 week high/low/change, beta) locally
+        from one bulk price download instead of scraping them, and fills them into the ticker dataframes
+        Parameters:
+            tickers (str or iterable list of strings):
+                If 'all', will use all the stored tickers, otherwise provide a list of tickers
+            prices (dict) : 'Close' (and optionally 'High', 'Low') daily price panels including the benchmark column,
+                as returned by prices.load_price_panel, downloaded if not provided
+            benchmark (str) : ticker of the market index for the beta
+            period (str) : length of the downloaded price history, at least 5y for the beta
+        Returns:
+            pd.DataFrame of the computed statistics, indexed by ticker, tickers without price data are skipped
+        '''
+        if isinstance(tickers, str):
+            tickers = list(self.tickers) if tickers.upper() == 'ALL' else [tickers]
+        tickers = list(tickers)
+        if prices is None:
+            prices = load_price_panel(tickers + [benchmark], period=period, interval='1d', fields=['Close', 'High', 'Low'])
+
+        close = prices['Close']
+        missing = [ticker for ticker in tickers if ticker not in close.columns or close[ticker].isna().all()]
+        if missing:
+            logger.info(f'No price data for {missing}, skipped')
+            tickers = [ticker for ticker in tickers if ticker not in missing]
+        metrics = technical_metrics(
+            close.reindex(columns=tickers),
+            high=prices['High'].reindex(columns=tickers) if 'High' in prices else None,
+            low=prices['Low'].reindex(columns=tickers) if 'Low' in prices else None,
+            benchmark=close[benchmark] if benchmark in close.columns else None)
+
+        values = metrics.to_numpy()
+        for i, ticker in enumerate(metrics.index):
+            df = self.tickers.get(ticker)
+            if isinstance(df, pd.DataFrame):
+                df[list(metrics.columns)] = values[i:i+1]
+            else:
+                self.tickers[ticker] = metrics.iloc[i:i+1]
+        logger.info(f'Computed technical stats for {len(metrics)} tickers')
+        return metrics
+
     def clean_df(self, df):
         '''
         Function to cast and clean the dataframe via the following:
@@ -262,7 +415,48 @@ class YfScrapper():
             return sp_df
 
     def to_csv(self, filepath):
-        if self.compiled_dataframes:
+        if self.compiled_dataframes is not None:
             self.compiled_dataframes.to_csv(filepath + '.csv')
             logger.info(f'File {filepath} saved!')
 
+    def to_parquet(self, snapshot_date: str = None, universe: str = 'custom', root: str = DATASET_ROOT, chunk_size: int = 100) -> str:
+        '''
+        Writes the statistics of all tickers into the partitioned parquet dataset, see modules.dataset.
+        Tickers are streamed in chunks so the whole universe is never concatenated in memory
+        Parameters:
+            snapshot_date (str) : date of the snapshot 'YYYY-MM-DD', defaults to today
+            universe (str) : name of the universe, e.g. 'sp500' or 'portfolio'
+            root (str) : root directory of the datasets
+            chunk_size (int) : number of tickers per chunk
+        Returns:
+            directory of the written partition
+        '''
+        dfs = [ticker for ticker in self.tickers.values() if isinstance(ticker, pd.DataFrame)]
+        if not dfs:
+            logger.info('No statistics to write')
+            return None
+        columns = list(dict.fromkeys(col for df in dfs for col in df.columns)) # Same schema for every chunk
+        tables = (statistics_table(pd.concat(dfs[i:i+chunk_size]).reindex(columns=columns)) for i in range(0, len(dfs), chunk_size))
+        return write_dataset(tables, 'statistics', snapshot_date=snapshot_date, universe=universe, root=root)
+
+_replay_scrapper = None
+
+def _init_replay(mapping_dict: dict, root: str) -> None:
+    '''
+    Creates the scrapper and cache of a replay worker process once
+    '''
+    global _replay_scrapper
+    _replay_scrapper = YfScrapper()
+    _replay_scrapper.mapping_dict = mapping_dict
+    _replay_scrapper.cache = HtmlCache(root)
+
+def _replay_page(entry: tuple, clean_df: bool) -> pd.DataFrame:
+    '''
+    Parses a cached page in a replay worker process, None if it cannot be parsed
+    '''
+    ticker, digest = entry
+    try:
+        return _replay_scrapper._parse_stats_page(ticker, _replay_scrapper.cache.read(digest), clean_df=clean_df)
+    except Exception as e:
+        logger.info(f'Failed to parse the cached page of {ticker}: {e!r}')
+        return None
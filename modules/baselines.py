@@ -0,0 +1,158 @@
+import warnings
+import numpy as np
+
+# Baseline forecasting methods, from the cheapest to the most flexible
+METHODS = ['naive', 'seasonal_naive', 'drift', 'ses', 'holt']
+# Grids of smoothing parameters, searched for every ticker at once
+ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1.0])
+BETAS = np.array([0.01, 0.05, 0.1, 0.2])
+
+def _ffill(y: np.ndarray) -> np.ndarray:
+    '''
+    Forward fills NaN values along the time axis, leading NaN values are kept
+    '''
+    valid = ~np.isnan(y)
+    positions = np.where(valid, np.arange(y.shape[1]), 0)
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    filled = y[np.arange(len(y))[:, None], positions]
+    return np.where(np.cumsum(valid, axis=1) > 0, filled, np.nan)
+
+def naive(y: np.ndarray, steps: int) -> np.ndarray:
+    '''
+    Repeats the last value
+    Parameters:
+        y (np.ndarray) : array of shape (tickers, time), missing values are NaN
+        steps (int) : number of periods to forecast
+    Returns:
+        np.ndarray of shape (tickers, steps)
+    '''
+    return np.repeat(_ffill(y)[:, -1:], steps, axis=1)
+
+def seasonal_naive(y: np.ndarray, steps: int, m: int) -> np.ndarray:
+    '''
+    Repeats the values of the last season, falls back to the last value if the history is shorter than a season
+    Parameters:
+        y (np.ndarray) : array of shape (tickers, time)
+        steps (int) : number of periods to forecast
+        m (int) : number of periods in a season
+    '''
+    y = _ffill(y)
+    if m < 1 or y.shape[1] < m:
+        return np.repeat(y[:, -1:], steps, axis=1)
+    season = y[:, -m:]
+    forecast = season[:, np.arange(steps) % m]
+    return np.where(np.isnan(forecast), y[:, -1:], forecast)
+
+def drift(y: np.ndarray, steps: int) -> np.ndarray:
+    '''
+    Extends the line between the first and last values
+    Parameters:
+        y (np.ndarray) : array of shape (tickers, time)
+        steps (int) : number of periods to forecast
+    '''
+    y = _ffill(y)
+    valid = ~np.isnan(y)
+    first = np.argmax(valid, axis=1)
+    start = y[np.arange(len(y)), first]
+    periods = y.shape[1] - 1 - first
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(periods > 0, (y[:, -1] - start) / periods, 0)
+    return y[:, -1:] + slope[:, None] * np.arange(1, steps+1)
+
+def exponential_smoothing(y: np.ndarray, steps: int, trend: bool = False, alphas: np.ndarray = ALPHAS,
+                          betas: np.ndarray = BETAS) -> tuple:
+    '''
+    Simple (or Holt's linear trend) exponential smoothing, the smoothing parameters of every ticker are chosen
+    from a grid by their one step ahead squared error, all tickers and parameters are smoothed in the same pass
+    Parameters:
+        y (np.ndarray) : array of shape (tickers, time)
+        steps (int) : number of periods to forecast
+        trend (bool) : whether to smooth a trend (Holt) or only the level (simple)
+        alphas (np.ndarray) : grid of level smoothing parameters
+        betas (np.ndarray) : grid of trend smoothing parameters, only used with a trend
+    Returns:
+        (forecast of shape (tickers, steps), parameters of shape (tickers, 2) as [alpha, beta])
+    '''
+    if trend:
+        alpha, beta = (grid.ravel()[:, None] for grid in np.meshgrid(alphas, betas))
+    else:
+        alpha, beta = alphas[:, None], np.zeros((len(alphas), 1))
+    shape = (len(alpha), len(y))
+    level, slope, sse = np.full(shape, np.nan), np.zeros(shape), np.zeros(shape)
+    for t in range(y.shape[1]):
+        value = y[:, t]
+        valid = ~np.isnan(value)
+        started = ~np.isnan(level)
+        prediction = level + slope
+        error = np.where(valid & started, value - prediction, 0)
+        sse += error**2
+        # Error correction form: level = prediction + alpha * error, slope += alpha * beta * error
+        level = np.where(started, prediction + alpha * error, np.where(valid, value, np.nan))
+        slope = np.where(started, slope + alpha * beta * error, 0)
+
+    best = np.argmin(sse, axis=0)
+    tickers = np.arange(len(y))
+    level, slope = level[best, tickers], slope[best, tickers]
+    forecast = level[:, None] + slope[:, None] * np.arange(1, steps+1)
+    return forecast, np.column_stack([alpha[best, 0], beta[best, 0]])
+
+def forecast_method(y: np.ndarray, method: str, steps: int, m: int = 52) -> np.ndarray:
+    '''
+    Forecasts every ticker with one of the METHODS
+    Returns:
+        np.ndarray of shape (tickers, steps)
+    '''
+    if method == 'naive':
+        return naive(y, steps)
+    elif method == 'seasonal_naive':
+        return seasonal_naive(y, steps, m)
+    elif method == 'drift':
+        return drift(y, steps)
+    elif method == 'ses':
+        return exponential_smoothing(y, steps)[0]
+    elif method == 'holt':
+        return exponential_smoothing(y, steps, trend=True)[0]
+    raise ValueError(f'Invalid method: {method}, must be one of {METHODS}')
+
+def backtest_errors(y: np.ndarray, steps: int, m: int = 52, methods: list = METHODS) -> np.ndarray:
+    '''
+    Holds out the last periods of every ticker and scores each method on them with the mean absolute scaled error,
+    the mean absolute error divided by the in-sample error of the one step naive forecast
+    Parameters:
+        y (np.ndarray) : array of shape (tickers, time)
+        steps (int) : number of periods held out
+        m (int) : number of periods in a season
+        methods (list) : methods to score
+    Returns:
+        np.ndarray of shape (tickers, methods), NaN where a ticker has no values to score
+    '''
+    train, test = y[:, :-steps], y[:, -steps:]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # Mean of tickers without values
+        scale = np.nanmean(np.abs(np.diff(train, axis=1)), axis=1)
+        errors = np.column_stack([np.nanmean(np.abs(test - forecast_method(train, method, steps, m)), axis=1)
+                                  for method in methods])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return errors / scale[:, None]
+
+def baseline_forecast(y: np.ndarray, steps: int, m: int = 52, methods: list = METHODS, holdout: int = None) -> tuple:
+    '''
+    Forecasts every ticker with the baseline method with the lowest backtest error
+    Parameters:
+        y (np.ndarray) : array of shape (tickers, time)
+        steps (int) : number of periods to forecast
+        m (int) : number of periods in a season
+        methods (list) : methods to choose from
+        holdout (int) : number of periods held out for the backtest, defaults to steps
+    Returns:
+        (forecast of shape (tickers, steps), chosen method of every ticker, backtest error of the chosen method)
+    '''
+    errors = backtest_errors(y, holdout or steps, m, methods)
+    filled = np.where(np.isnan(errors), np.inf, errors)
+    best = np.argmin(filled, axis=1)
+    forecast = np.full((len(y), steps), np.nan)
+    for i, method in enumerate(methods):
+        rows = best == i
+        if rows.any():
+            forecast[rows] = forecast_method(y[rows], method, steps, m)
+    return forecast, np.array(methods, dtype=object)[best], errors[np.arange(len(y)), best]
@@ -0,0 +1,118 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import pandas as pd
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from modules.utils import logger
+
+FIGSIZE = (14, 6)
+
+def draw_forecast(ax, ticker: str, forecast: pd.Series, conf_int: pd.DataFrame = None, ts: pd.DataFrame = None,
+                  confidence: int = None, forecast_only: bool = False) -> None:
+    '''
+    Draws a forecast, its confidence interval and optionally the past prices on an axes
+    Parameters:
+        ax (matplotlib.axes.Axes) : axes to draw on
+        ticker (str) : ticker of the forecast, for the title
+        forecast (pd.Series) : forecast with a period index
+        conf_int (pd.DataFrame) : 'lower' and 'upper' columns with a period index
+        ts (pd.DataFrame) : past prices with a period index
+        confidence (int) : confidence level of the interval in %, for the legend
+        forecast_only (bool) : whether to plot only the forecast or include past prices
+    '''
+    ax.set_title(f'Forecast for {ticker}')
+    ax.plot(forecast.to_timestamp(), color='salmon', label='Forecast')
+    if conf_int is not None:
+        ax.fill_between(conf_int.index.to_timestamp(), conf_int['lower'], conf_int['upper'],
+                        color='salmon', alpha=0.2, label=f'{confidence}% interval')
+    if not forecast_only and ts is not None:
+        ax.plot(ts.to_timestamp(), color='grey', label='Actual')
+    else:
+        ax.set_xticks(forecast.index.to_timestamp())
+        ax.set_xticklabels(forecast.index.astype(str), rotation=45, fontsize=8)
+        ax.grid()
+    ax.legend()
+
+def draw_validation(ax, ticker: str, test: pd.DataFrame, forecast: pd.Series, ts: pd.DataFrame = None,
+                    forecast_period_only: bool = True) -> None:
+    '''
+    Draws the forecast of a validation against the actual prices of the validation periods
+    Parameters:
+        ax (matplotlib.axes.Axes) : axes to draw on
+        ticker (str) : ticker of the validation, for the title
+        test (pd.DataFrame) : actual prices of the validation periods
+        forecast (pd.Series) : forecast of the validation periods, see Forecaster.forecast_validation()
+        ts (pd.DataFrame) : full price history
+        forecast_period_only (bool) : plot only the forecast period
+    '''
+    ax.set_title(f'Validation for {ticker}')
+    ax.plot(test.to_timestamp(), color='grey', label='Actual')
+    ax.plot(forecast.to_timestamp().shift(-1), color='salmon', label='Forecast')
+    if not forecast_period_only and ts is not None:
+        ax.plot(ts.to_timestamp())
+    else:
+        ax.set_xticks(forecast.index.to_timestamp())
+        ax.set_xticklabels(forecast.index.astype(str), rotation=45, fontsize=8)
+        ax.legend()
+        ax.grid()
+
+DRAWERS = {
+    'forecast': draw_forecast,
+    'validation': draw_validation,
+}
+
+def render(path: str, kind: str, data: dict, formats: tuple = ('png',), dpi: int = 100) -> list:
+    '''
+    Renders one chart off-screen with the Agg canvas and writes it to files.
+    The figure is not registered with pyplot, so it is freed as soon as it is closed here
+    Parameters:
+        path (str) : filepath without extension
+        kind (str) : 'forecast' or 'validation'
+        data (dict) : keyword arguments of the drawer, see draw_forecast() and draw_validation()
+        formats (tuple) : file formats, e.g. ('png', 'svg')
+        dpi (int) : resolution of raster formats
+    Returns:
+        list of the written filepaths
+    '''
+    fig = Figure(figsize=FIGSIZE)
+    FigureCanvasAgg(fig)
+    try:
+        DRAWERS[kind](fig.add_subplot(), **data)
+        fig.tight_layout()
+        for fmt in formats:
+            fig.savefig(f'{path}.{fmt}', format=fmt, dpi=dpi)
+        return [f'{path}.{fmt}' for fmt in formats]
+    finally:
+        fig.clear()
+
+def render_chart_pack(jobs, out_dir: str = 'reports/charts', formats: tuple = ('png',), workers: int = None,
+                      dpi: int = 100, tasks_per_worker: int = 50) -> list:
+    '''
+    Renders charts in parallel worker processes.
+    Jobs are consumed lazily and at most two per worker are in flight, so memory stays flat for large packs,
+    and workers are replaced after tasks_per_worker charts to release any memory held by matplotlib caches
+    Parameters:
+        jobs (iterable) : (name, kind, data) tuples, see render()
+        out_dir (str) : directory of the files
+        formats (tuple) : file formats, e.g. ('png', 'svg')
+        workers (int) : number of processes, defaults to the number of cpus
+        dpi (int) : resolution of raster formats
+        tasks_per_worker (int) : charts rendered by a process before it is replaced
+    Returns:
+        list of the written filepaths
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    filepaths, pending = [], set()
+    context = multiprocessing.get_context('spawn') # max_tasks_per_child is not supported with fork
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=tasks_per_worker) as executor:
+        for name, kind, data in jobs:
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                filepaths.extend(path for future in done for path in future.result())
+            pending.add(executor.submit(render, os.path.join(out_dir, f'{name}_{kind}'), kind, data, formats, dpi))
+        for future in wait(pending).done:
+            filepaths.extend(future.result())
+    logger.info(f'{len(filepaths)} chart files written to {out_dir}')
+    return sorted(filepaths)
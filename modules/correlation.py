@@ -0,0 +1,218 @@
+import os
+import re
+import glob
+import json
+import hashlib
+from datetime import date
+import pandas as pd
+import numpy as np
+from modules.prices import load_price_panel
+from modules.utils import logger
+
+CACHE_DIR = 'data/cache/correlation'
+_cache = {}
+
+def log_returns(close: pd.DataFrame, min_periods: int = 20) -> pd.DataFrame:
+    '''
+    Aligned log returns of a price panel, missing prices stay NaN so tickers listed later keep their history
+    Parameters:
+        close (pd.DataFrame) : prices with dates as the index and tickers as the columns
+        min_periods (int) : minimum number of returns, tickers with fewer are dropped
+    Returns:
+        pd.DataFrame of log returns
+    '''
+    returns = np.log(close.sort_index()).diff().iloc[1:]
+    returns = returns.replace([np.inf, -np.inf], np.nan)
+    dropped = returns.columns[returns.count() < min_periods]
+    if len(dropped):
+        logger.info(f'Dropped {len(dropped)} tickers with less than {min_periods} returns')
+    return returns.drop(columns=dropped)
+
+def blockwise_covariance(returns: np.ndarray, block_size: int = 256, correlation: bool = False, shrinkage=None,
+                         out: np.ndarray = None, dtype=np.float64) -> tuple:
+    '''
+    Computes the covariance (or correlation) matrix of many series in blocks of columns, so only
+    two blocks of returns and one block of the result are worked on at a time.
+    Missing returns are excluded by demeaning and filling them with zeros, which approximates pairwise
+    complete estimates while keeping every block a single matrix product
+    Parameters:
+        returns (np.ndarray) : array of shape (time, tickers)
+        block_size (int) : number of tickers per block
+        correlation (bool) : whether to return the correlation instead of the covariance
+        shrinkage (float or str) : intensity in [0, 1] of the shrinkage of the off-diagonal terms towards zero,
+            or 'ledoit-wolf' to estimate the optimal intensity
+        out (np.ndarray) : preallocated (tickers, tickers) array to write into, e.g. a np.memmap for large universes
+        dtype : dtype of the result if out is not provided
+    Returns:
+        (matrix, shrinkage intensity used)
+    '''
+    n_periods, n = returns.shape
+    valid = ~np.isnan(returns)
+    counts = valid.sum(axis=0)
+    means = np.where(valid, returns, 0).sum(axis=0) / np.maximum(counts, 1)
+    centered = np.where(valid, returns - means, 0)
+    mask = valid.astype(np.float64)
+    std = np.sqrt((centered**2).sum(axis=0) / np.maximum(counts - 1, 1))
+    if out is None:
+        out = np.empty((n, n), dtype=dtype)
+
+    estimate = shrinkage == 'ledoit-wolf'
+    variance_sum, squares_sum = 0.0, 0.0
+    blocks = range(0, n, block_size)
+    for i in blocks:
+        x_i, m_i = centered[:, i:i+block_size], mask[:, i:i+block_size]
+        for j in blocks:
+            if j < i:
+                continue
+            x_j, m_j = centered[:, j:j+block_size], mask[:, j:j+block_size]
+            pairs = np.maximum(m_i.T @ m_j, 2)
+            cov = (x_i.T @ x_j) / (pairs - 1)
+            if estimate:
+                # Variance of every sample covariance, for the Ledoit-Wolf intensity of the off-diagonal terms
+                variance = ((x_i**2).T @ (x_j**2) / pairs - (cov * (pairs - 1) / pairs)**2) / pairs
+                off_diagonal = np.ones_like(cov, dtype=bool)
+                if i == j:
+                    np.fill_diagonal(off_diagonal, False)
+                weight = 1 if i == j else 2 # Blocks above the diagonal are counted for both triangles
+                variance_sum += weight * variance[off_diagonal].sum()
+                squares_sum += weight * (cov[off_diagonal]**2).sum()
+            if correlation:
+                cov = cov / np.outer(std[i:i+block_size], std[j:j+block_size])
+            out[i:i+block_size, j:j+block_size] = cov
+            out[j:j+block_size, i:i+block_size] = cov.T
+
+    intensity = 0.0
+    if estimate:
+        intensity = float(np.clip(variance_sum / squares_sum, 0, 1)) if squares_sum else 0.0
+    elif shrinkage:
+        intensity = float(shrinkage)
+    if intensity:
+        for i in blocks:
+            block = out[i:i+block_size]
+            diagonal = np.diagonal(block[:, i:i+block_size]).copy()
+            block *= 1 - intensity
+            np.fill_diagonal(block[:, i:i+block_size], diagonal)
+    if correlation:
+        np.fill_diagonal(out, 1)
+    return out, intensity
+
+def correlation_matrix(tickers: list, window: str = '1y', interval: str = '1d', correlation: bool = True, shrinkage=None,
+                       prices: pd.DataFrame = None, block_size: int = 256, cache_dir: str = CACHE_DIR, refresh: bool = False) -> pd.DataFrame:
+    '''
+    Correlation (or covariance) matrix of the log returns of a universe, cached in memory and on disk
+    by (universe, window, interval, as-of) so the O(n^2) computation is done once per universe and data.
+    Downloaded prices are as of today, so cached matrices expire daily, supplied prices are cut to the window
+    and keyed by their last date and a hash of their values. Results on disk are memory-mapped when loaded
+    Parameters:
+        tickers (list) : tickers of the universe
+        window (str) : length of the price history - '5y', '1y', 'ytd', '10y'
+        interval (str) : Interval of prices - '1wk', '1d', '1mo'
+        correlation (bool) : whether to return the correlation instead of the covariance
+        shrinkage (float or str) : see documentation on blockwise_covariance()
+        prices (pd.DataFrame) : closes of the universe with dates as the index, downloaded with one bulk request if not provided
+        block_size (int) : number of tickers per block
+        cache_dir (str) : directory of the cached matrices, None to only cache in memory
+        refresh (bool) : whether to recompute even if cached
+    Returns:
+        pd.DataFrame of tickers x tickers, tickers without enough returns are dropped
+    '''
+    universe = sorted(set(tickers))
+    if prices is not None:
+        prices = prices.reindex(columns=universe).sort_index()
+        prices = prices.loc[window_start(prices.index[-1], window):]
+        as_of = f'{prices.index[-1]:%Y-%m-%d}_{_panel_hash(prices)}'
+    else:
+        as_of = date.today().isoformat()
+    prefix = _cache_key(universe, window, interval, correlation, shrinkage)
+    key = f'{prefix}_{as_of}'
+    if not refresh and key in _cache:
+        return _cache[key]
+    filepath = os.path.join(cache_dir, key) if cache_dir else None
+    if not refresh and filepath and os.path.exists(filepath + '.npy'):
+        with open(filepath + '.json') as f:
+            labels = json.load(f)['tickers']
+        matrix = pd.DataFrame(np.load(filepath + '.npy', mmap_mode='r'), index=labels, columns=labels, copy=False)
+        _cache[key] = matrix
+        return matrix
+
+    if prices is None:
+        prices = load_price_panel(universe, period=window, interval=interval)['Close']
+    returns = log_returns(prices.reindex(columns=universe))
+    labels = returns.columns.to_list()
+    out = None
+    # Matrices of the same universe and settings as of other data are stale
+    for stale in [k for k in _cache if k.startswith(prefix + '_') and k != key]:
+        del _cache[stale]
+    if filepath:
+        os.makedirs(cache_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(glob.escape(cache_dir), glob.escape(prefix) + '_*')):
+            if not os.path.basename(stale).startswith(key + '.'):
+                os.remove(stale)
+        out = np.lib.format.open_memmap(filepath + '.npy', mode='w+', dtype=np.float64, shape=(len(labels), len(labels)))
+    values, intensity = blockwise_covariance(returns.to_numpy(dtype=np.float64), block_size=block_size,
+                                             correlation=correlation, shrinkage=shrinkage, out=out)
+    if filepath:
+        values.flush()
+        with open(filepath + '.json', 'w') as f:
+            json.dump({'tickers': labels, 'window': window, 'interval': interval, 'as_of': as_of, 'shrinkage': intensity}, f)
+    logger.info(f'Computed {len(labels)}x{len(labels)} matrix, shrinkage {intensity:.3f}')
+
+    matrix = pd.DataFrame(values, index=labels, columns=labels, copy=False)
+    _cache[key] = matrix
+    return matrix
+
+def average_correlation(corr: pd.DataFrame, tickers: list = None) -> float:
+    '''
+    Mean pairwise correlation within a group of tickers, lower means more diversified
+    '''
+    if tickers is not None:
+        tickers = [ticker for ticker in tickers if ticker in corr.index]
+        corr = corr.loc[tickers, tickers]
+    values = np.asarray(corr)
+    n = len(values)
+    if n < 2:
+        return np.nan
+    return float((np.nansum(values) - np.nansum(np.diagonal(values))) / (n * (n - 1)))
+
+def diversification_ratio(cov: pd.DataFrame, weights: pd.Series = None) -> float:
+    '''
+    Ratio of the weighted average volatility to the portfolio volatility, higher means more diversified
+    Parameters:
+        cov (pd.DataFrame) : covariance matrix of the portfolio tickers
+        weights (pd.Series) : weights by ticker, defaults to equal weights
+    '''
+    if weights is None:
+        weights = pd.Series(1 / len(cov), index=cov.index)
+    weights = weights.reindex(cov.index).fillna(0).to_numpy()
+    values = np.asarray(cov)
+    return float(weights @ np.sqrt(np.diagonal(values)) / np.sqrt(weights @ values @ weights))
+
+def window_start(last: pd.Timestamp, window: str) -> pd.Timestamp:
+    '''
+    First date of a yahoo finance period ending at last, e.g. '1y' before it, or the start of its year for 'ytd'
+    Parameters:
+        last (pd.Timestamp) : last date of the prices
+        window (str) : length of the price history - '5d', '3mo', '1y', 'ytd', 'max'
+    Returns:
+        pd.Timestamp, None for 'max'
+    '''
+    if window == 'max':
+        return None
+    if window == 'ytd':
+        return pd.Timestamp(year=last.year, month=1, day=1)
+    match = re.fullmatch(r'(\d+)(d|wk|mo|y)', window)
+    if not match:
+        raise ValueError(f"Invalid window: {window}, must be e.g. '5d', '1wk', '6mo', '1y', 'ytd' or 'max'")
+    n, unit = int(match.group(1)), match.group(2)
+    offset = {'d': pd.DateOffset(days=n), 'wk': pd.DateOffset(weeks=n), 'mo': pd.DateOffset(months=n), 'y': pd.DateOffset(years=n)}[unit]
+    return last - offset
+
+def _panel_hash(prices: pd.DataFrame) -> str:
+    digest = hashlib.sha1(np.ascontiguousarray(prices.to_numpy(dtype=np.float64)).tobytes())
+    digest.update(np.asarray(prices.index.asi8).tobytes())
+    return digest.hexdigest()[:16]
+
+def _cache_key(tickers: list, window: str, interval: str, correlation: bool, shrinkage) -> str:
+    universe = hashlib.sha1(','.join(sorted(set(tickers))).encode()).hexdigest()[:16]
+    kind = 'corr' if correlation else 'cov'
+    return f'{kind}_{window}_{interval}_{shrinkage}_{universe}'
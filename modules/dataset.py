@@ -0,0 +1,142 @@
+import os
+import itertools
+from datetime import date
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+from modules.ForecastStore import ForecastStore
+from modules.utils import logger
+
+DATASET_ROOT = 'data/dataset'
+PARTITIONING = ds.partitioning(pa.schema([('snapshot_date', pa.string()), ('universe', pa.string())]), flavor='hive')
+DATE_COLUMNS = ['Dividend Date', 'Ex-Dividend Date', 'Last Split Date', 'Fiscal Year Ends', 'Most Recent Quarter (mrq)']
+
+def statistics_table(df: pd.DataFrame) -> pa.Table:
+    '''
+    Casts compiled statistics into a typed arrow table: float64 metrics, date32 dates and string names
+    Parameters:
+        df (pd.DataFrame) : statistics indexed by ticker, e.g. YfScrapper.compile_dataframes()
+    '''
+    df = df.copy()
+    df.columns = [str(col).strip() for col in df.columns]
+    for col in df.columns:
+        if col in DATE_COLUMNS:
+            df[col] = pd.to_datetime(df[col], errors='coerce').dt.date
+        elif col != 'Name':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(np.float64)
+    df.index = df.index.astype(str)
+    df.index.name = 'Ticker'
+    fields = [pa.field('Ticker', pa.string())]
+    for col in df.columns:
+        if col in DATE_COLUMNS:
+            fields.append(pa.field(col, pa.date32()))
+        elif col == 'Name':
+            fields.append(pa.field(col, pa.string()))
+        else:
+            fields.append(pa.field(col, pa.float64()))
+    return pa.Table.from_pandas(df.reset_index(), schema=pa.schema(fields), preserve_index=False)
+
+def forecasts_table(store: ForecastStore) -> pa.Table:
+    '''
+    Flattens the forecast store into a long arrow table of (ticker, step, period end, mean, lower, upper)
+    '''
+    rows = np.array(list(store.index.values()), dtype=int)
+    steps = store.steps[rows].astype(int)
+    row_of_value = np.repeat(rows, steps)
+    step = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    values = store.values[row_of_value, step]
+    period_end = [store._periods(row).end_time.normalize().to_numpy(dtype='datetime64[ns]') for row in rows]
+    return pa.table({
+        'Ticker': pa.array(np.repeat(np.array(list(store.index), dtype=object), steps), pa.string()),
+        'step': pa.array(step + 1, pa.int32()),
+        'period_end': pa.array(np.concatenate([np.array([], dtype='datetime64[ns]'), *period_end]), pa.timestamp('ns')),
+        'mean': pa.array(values[:, 0], pa.float64()),
+        'lower': pa.array(values[:, 1], pa.float64()),
+        'upper': pa.array(values[:, 2], pa.float64()),
+    })
+
+def write_dataset(tables, kind: str, snapshot_date: str = None, universe: str = 'custom',
+                  root: str = DATASET_ROOT, compression: str = 'zstd') -> str:
+    '''
+    Writes tables into a parquet dataset partitioned by snapshot date and universe,
+    an existing partition of the same date and universe is replaced
+    Parameters:
+        tables (pa.Table or iterable of pa.Table) : table or stream of tables with the same schema to write,
+            see statistics_table() and forecasts_table()
+        kind (str) : name of the dataset, e.g. 'statistics' or 'forecasts'
+        snapshot_date (str) : date of the snapshot 'YYYY-MM-DD', defaults to today
+        universe (str) : name of the universe, e.g. 'sp500' or 'portfolio'
+        root (str) : root directory of the datasets
+        compression (str) : parquet compression codec
+    Returns:
+        directory of the written partition
+    '''
+    snapshot_date = snapshot_date or date.today().isoformat()
+    tables = iter([tables] if isinstance(tables, pa.Table) else tables)
+    first = next(tables)
+    schema = first.schema.append(pa.field('snapshot_date', pa.string())).append(pa.field('universe', pa.string()))
+    count = 0
+
+    def batches():
+        nonlocal count
+        for table in itertools.chain([first], tables):
+            table = table.append_column('snapshot_date', pa.array([snapshot_date] * len(table), pa.string()))
+            table = table.append_column('universe', pa.array([universe] * len(table), pa.string()))
+            count += len(table)
+            yield from table.cast(schema).to_batches()
+
+    base_dir = os.path.join(root, kind)
+    ds.write_dataset(batches(), base_dir, schema=schema, format='parquet', partitioning=PARTITIONING,
+                     file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+                     basename_template='part-{i}.parquet', existing_data_behavior='delete_matching')
+    partition = os.path.join(base_dir, f'snapshot_date={snapshot_date}', f'universe={universe}')
+    logger.info(f'{count} rows written to {partition}')
+    return partition
+
+def read_dataset(kind: str, columns: list = None, filters: list = None, root: str = DATASET_ROOT) -> pd.DataFrame:
+    '''
+    Reads a partitioned dataset, only the requested columns are read and the filters are pushed down
+    to skip partitions and row groups which cannot match
+    Parameters:
+        kind (str) : name of the dataset, e.g. 'statistics' or 'forecasts'
+        columns (list) : columns to read in addition to 'Ticker', 'snapshot_date' and 'universe', defaults to all
+        filters (list) : [(column, op, value)] with op one of '==', '!=', '<', '<=', '>', '>=', 'in'
+        root (str) : root directory of the datasets
+    Returns:
+        pd.DataFrame
+    Example:
+        read_dataset('statistics', columns=['Market Cap (B)', 'Trailing P/E'],
+                     filters=[('snapshot_date', '>=', '2023-01-01'), ('universe', '==', 'sp500')])
+    '''
+    dataset = ds.dataset(os.path.join(root, kind), format='parquet', partitioning=PARTITIONING)
+    if columns is not None:
+        columns = list(dict.fromkeys(['Ticker', 'snapshot_date', 'universe', *columns]))
+    table = dataset.to_table(columns=columns, filter=_expression(filters))
+    return table.to_pandas()
+
+def _expression(filters: list):
+    '''
+    Combines (column, op, value) filters into a pyarrow dataset expression
+    '''
+    expression = None
+    for column, op, value in filters or []:
+        field = ds.field(column)
+        if op == 'in':
+            condition = field.isin(value)
+        elif op == '==':
+            condition = field == value
+        elif op == '!=':
+            condition = field != value
+        elif op == '<':
+            condition = field < value
+        elif op == '<=':
+            condition = field <= value
+        elif op == '>':
+            condition = field > value
+        elif op == '>=':
+            condition = field >= value
+        else:
+            raise ValueError(f'Invalid operator: {op}')
+        expression = condition if expression is None else expression & condition
+    return expression
@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+
+def lttb(y: np.ndarray, n_out: int, x: np.ndarray = None) -> np.ndarray:
+    '''
+    Largest-Triangle-Three-Buckets downsampling, keeps the points forming the largest triangles
+    with their neighbouring buckets so peaks and troughs of the series are preserved
+    Parameters:
+        y (np.ndarray) : values of the series
+        n_out (int) : number of points to keep, at least 3
+        x (np.ndarray) : positions of the values, defaults to their order
+    Returns:
+        np.ndarray of the sorted indices of the kept points
+    '''
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # First and last points are always kept, the others are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    indices = np.empty(n_out, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+
+    # Averages of every bucket (and of the last point), the third point of the triangles
+    starts = edges # The last edge is the last point
+    valid = ~np.isnan(y)
+    counts = np.add.reduceat(valid.astype(np.float64), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = np.add.reduceat(x, starts) / np.diff(np.append(starts, n))
+        mean_y = np.add.reduceat(np.where(valid, y, 0), starts) / counts
+
+    selected = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i+1]
+        areas = np.abs((x[selected] - mean_x[i+1]) * (y[start:end] - y[selected]) - (x[selected] - x[start:end]) * (mean_y[i+1] - y[selected]))
+        selected = start + int(np.nanargmax(areas)) if not np.isnan(areas).all() else start
+        indices[i+1] = selected
+    return indices
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    '''
+    Min/max bucketing, keeps the lowest and highest point of every bucket in one vectorized pass
+    Parameters:
+        y (np.ndarray) : values of the series
+        n_out (int) : maximum number of points to keep, the first and last point and two per bucket
+    Returns:
+        np.ndarray of the sorted indices of the kept points
+    '''
+    n = len(y)
+    if n_out >= n or n_out < 2:
+        return np.arange(n)
+    # First and last points are always kept, the others are split into buckets with the remaining budget
+    n_buckets = (n_out - 2) // 2
+    if n_buckets < 1:
+        return np.array([0, n - 1])
+    inner = np.asarray(y, dtype=np.float64)[1:n-1]
+    starts = np.linspace(0, len(inner), n_buckets + 1).astype(int)[:-1]
+    sizes = np.diff(np.append(starts, len(inner)))
+    positions = np.arange(len(inner))
+    kept = []
+    for extreme in (np.fmin, np.fmax):
+        # First position of every bucket holding its extreme value, buckets of only NaN have none
+        values = np.repeat(extreme.reduceat(inner, starts), sizes)
+        first = np.minimum.reduceat(np.where(inner == values, positions, len(inner)), starts)
+        kept.append(first[first < len(inner)])
+    return np.unique(np.concatenate([[0, n - 1], 1 + np.concatenate(kept)]))
+
+def downsample(data, n_out: int, method: str = 'lttb'):
+    '''
+    Downsamples a series or dataframe for charts, points are selected for every column and combined
+    Parameters:
+        data (pd.Series or pd.DataFrame) : data to chart
+        n_out (int) : number of points per column, e.g. the pixel width of the chart
+        method (str) : 'lttb' or 'minmax'
+    Returns:
+        data with only the selected rows
+    '''
+    if len(data) <= n_out:
+        return data
+    frame = data.to_frame() if isinstance(data, pd.Series) else data
+    select = lttb if method == 'lttb' else minmax
+    rows = np.unique(np.concatenate([select(frame[col].to_numpy(dtype=np.float64), n_out) for col in frame.columns]))
+    return data.iloc[rows]
@@ -0,0 +1,23 @@
+import yfinance as yf
+import pandas as pd
+from modules.utils import logger
+
+def load_price_panel(tickers: list, period: str = '5y', interval: str = '1d', fields: list = ['Close']) -> dict:
+    '''
+    Downloads the price history of a universe in one bulk request
+    Parameters:
+        tickers (list) : tickers to download
+        period (str) : length of time series - '5y', '1y', 'ytd', '10y'
+        interval (str) : Interval of prices - '1wk', '1d', '1mo'
+        fields (list) : price types to return - 'Open', 'Close', 'High', 'Low', 'Volume'
+    Returns:
+        dictionary of field -> pd.DataFrame with dates as the index and tickers as the columns
+    '''
+    tickers = list(tickers)
+    logger.info(f'Downloading {interval} prices for {len(tickers)} tickers')
+    df = yf.download(tickers, period=period, interval=interval, auto_adjust=False, progress=False, group_by='column')
+    if not isinstance(df.columns, pd.MultiIndex):
+        df.columns = pd.MultiIndex.from_product([df.columns, tickers])
+    if df.index.tz is not None:
+        df.index = df.index.tz_localize(None)
+    return {field: df[field].reindex(columns=tickers) for field in fields}
@@ -0,0 +1,79 @@
+import re
+import glob
+import os
+import pandas as pd
+import numpy as np
+from modules.YfScrapper import MAPPING_DICT
+from modules.utils import logger
+
+SNAPSHOT_PATTERN = 'data/s&p_*.csv'
+
+def extract_ticker(name: str) -> str:
+    '''
+    Extracts the ticker from 'Name (TICKER)' strings of older snapshots, bare tickers are returned as is
+    '''
+    if not isinstance(name, str):
+        return np.nan
+    ticker_symbol = re.findall(r'\(([a-zA-Z\-\.]+)\)', name)
+    if not ticker_symbol:
+        return name.strip()
+    # Names can contain brackets themselves, the ticker is always the last one
+    return ticker_symbol[-1]
+
+def normalize_metric(metric: str) -> str:
+    '''
+    Normalizes a metric name, stripping trailing spaces and collapsing repeated spaces
+    '''
+    return re.sub(r'\s+', ' ', str(metric)).strip()
+
+def resolve_metric(metric: str, columns: list) -> str:
+    '''
+    Finds the column of a metric, accepting the column name itself, the yahoo name from MAPPING_DICT
+    or the name without its unit e.g. 'Profit Margin' or 'Market Cap (intraday)' for 'Market Cap (B)'
+    Parameters:
+        metric (str) : metric to resolve
+        columns (list) : normalized column names
+    Returns:
+        column name
+    '''
+    metric = normalize_metric(metric)
+    if metric in columns:
+        return metric
+    mapped = MAPPING_DICT.get(metric)
+    if mapped in columns:
+        return mapped
+    candidates = [col for col in columns if col.lower().startswith(metric.lower() + ' (')]
+    if len(candidates) == 1:
+        return candidates[0]
+    raise KeyError(f'No such metric: {metric}')
+
+def load_snapshot(filepath: str) -> pd.DataFrame:
+    '''
+    Loads a dated statistics snapshot into a common format, whichever version of the scrapper saved it
+    Parameters:
+        filepath (str) : csv of the snapshot
+    Returns:
+        pd.DataFrame indexed by ticker with normalized metric names as the columns
+    '''
+    df = pd.read_csv(filepath)
+    df = df.drop(columns=[col for col in df.columns if col.startswith('Unnamed')])
+    df.columns = [normalize_metric(col) for col in df.columns]
+    df['Ticker'] = df['Ticker'].map(extract_ticker)
+    df = df.dropna(subset=['Ticker']).drop_duplicates(subset='Ticker').set_index('Ticker')
+    return df
+
+def snapshot_dates(pattern: str = SNAPSHOT_PATTERN) -> dict:
+    '''
+    Finds the dated snapshots saved as {name}_{YYYY-MM-DD}.csv
+    Parameters:
+        pattern (str) : glob pattern of the snapshots
+    Returns:
+        dictionary of date (str) -> filepath, sorted by date
+    '''
+    snapshots = {}
+    for filepath in glob.glob(pattern):
+        match = re.fullmatch(r'[^_]+_(\d{4}-\d{2}-\d{2})\.csv', os.path.basename(filepath))
+        if match:
+            snapshots[match.group(1)] = filepath
+    logger.info(f'Found {len(snapshots)} snapshots for {pattern}')
+    return dict(sorted(snapshots.items()))
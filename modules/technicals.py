@@ -0,0 +1,97 @@
+import pandas as pd
+import numpy as np
+
+# Columns of the yahoo statistics page which can be derived from the price history
+TECHNICAL_COLUMNS = [
+    'Beta (5Y Monthly)',
+    '52 Week Change (%)',
+    'S&P500 52-Week Change (%)',
+    '52 Week High',
+    '52 Week Low',
+    '50-Day Moving Average',
+    '200-Day Moving Average',
+]
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    '''
+    Rolling mean along the first axis from cumulative sums, ignoring NaN values
+    Parameters:
+        values (np.ndarray) : array of shape (time, tickers)
+        window (int) : number of periods in the window
+    Returns:
+        np.ndarray of the same shape, NaN where the window has no values
+    '''
+    valid = ~np.isnan(values)
+    zeros = np.zeros((1, values.shape[1]))
+    sums = np.concatenate([zeros, np.cumsum(np.where(valid, values, 0), axis=0)])
+    counts = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    start = np.maximum(np.arange(1, len(values)+1) - window, 0)
+    window_sums = sums[1:] - sums[start]
+    window_counts = counts[1:] - counts[start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+
+def monthly_returns(close: pd.DataFrame, months: int = 60) -> pd.DataFrame:
+    '''
+    Returns of the last monthly closes, from daily closes
+    '''
+    monthly = close.to_period('M').groupby(level=0).last()
+    return monthly.pct_change(fill_method=None).iloc[-months:]
+
+def beta(returns: np.ndarray, market: np.ndarray) -> np.ndarray:
+    '''
+    Beta of every column of returns against the market returns, using the periods where both are available
+    Parameters:
+        returns (np.ndarray) : array of shape (time, tickers)
+        market (np.ndarray) : array of shape (time,)
+    Returns:
+        np.ndarray of shape (tickers,)
+    '''
+    market = np.broadcast_to(market[:, None], returns.shape)
+    valid = ~np.isnan(returns) & ~np.isnan(market)
+    counts = valid.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_returns = np.where(valid, returns, 0).sum(axis=0) / counts
+        mean_market = np.where(valid, market, 0).sum(axis=0) / counts
+        covariance = np.where(valid, (returns - mean_returns) * (market - mean_market), 0).sum(axis=0)
+        variance = np.where(valid, (market - mean_market)**2, 0).sum(axis=0)
+        return np.where(counts > 1, covariance / variance, np.nan)
+
+def technical_metrics(close: pd.DataFrame, high: pd.DataFrame = None, low: pd.DataFrame = None, benchmark: pd.Series = None) -> pd.DataFrame:
+    '''
+    Computes the price derived statistics of a universe, as shown on the yahoo statistics page
+    Parameters:
+        close (pd.DataFrame) : daily closes with dates as the index and tickers as the columns, at least 5 years for the beta
+        high (pd.DataFrame) : daily highs for the 52 week high, defaults to the closes
+        low (pd.DataFrame) : daily lows for the 52 week low, defaults to the closes
+        benchmark (pd.Series) : daily closes of the market index (e.g. ^GSPC) for the beta and S&P500 52-Week Change
+    Returns:
+        pd.DataFrame indexed by ticker with the columns of TECHNICAL_COLUMNS
+    '''
+    close = close.sort_index()
+    values = close.ffill().to_numpy(dtype=np.float64)
+    high = values if high is None else high.reindex_like(close).to_numpy(dtype=np.float64)
+    low = values if low is None else low.reindex_like(close).to_numpy(dtype=np.float64)
+
+    # First row within the last 52 weeks
+    year_start = close.index.searchsorted(close.index[-1] - pd.Timedelta(days=365))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            '52 Week Change (%)': (values[-1] / values[year_start] - 1) * 100,
+            '52 Week High': np.nanmax(high[year_start:], axis=0),
+            '52 Week Low': np.nanmin(low[year_start:], axis=0),
+            # Only the latest window is needed for the current moving averages
+            '50-Day Moving Average': rolling_mean(values[-50:], 50)[-1],
+            '200-Day Moving Average': rolling_mean(values[-200:], 200)[-1],
+        }
+
+    if benchmark is not None:
+        benchmark = benchmark.reindex(close.index).ffill()
+        market = benchmark.to_numpy(dtype=np.float64)
+        metrics['S&P500 52-Week Change (%)'] = np.full(len(close.columns), (market[-1] / market[year_start] - 1) * 100)
+        returns = monthly_returns(close)
+        market_returns = monthly_returns(benchmark.to_frame()).iloc[:, 0].reindex(returns.index)
+        metrics['Beta (5Y Monthly)'] = beta(returns.to_numpy(dtype=np.float64), market_returns.to_numpy(dtype=np.float64))
+
+    df = pd.DataFrame(metrics, index=close.columns).round(2)
+    return df[[col for col in TECHNICAL_COLUMNS if col in df.columns]]
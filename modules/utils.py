@@ -1,10 +1,16 @@
 import logging
+import multiprocessing
 import sys
 
-def configure_logging(file_path=None, streaming=None, level=logging.INFO):
+def configure_logging(file_path=None, streaming=None, level=logging.INFO, mode=None):
     '''
     Initiates the logger
+    Parameters:
+        mode (str) : file mode of the log, defaults to 'w' so every run starts a new log, and to 'a' in child processes
+            (e.g. spawned chart workers) so importing this module does not truncate the log of their parent
     '''
+    if mode is None:
+        mode = 'w' if multiprocessing.parent_process() is None else 'a'
 
     logger = logging.getLogger()
     logger.setLevel(level)
@@ -13,7 +19,7 @@ def configure_logging(file_path=None, streaming=None, level=logging.INFO):
     if not len(logger.handlers):
         # Add a filehandler to output to a file
         if file_path:
-            file_handler = logging.FileHandler(file_path, mode='w')
+            file_handler = logging.FileHandler(file_path, mode=mode, delay=True) # Opened on the first record, see append_log()
             file_handler.setLevel(level)
             file_handler.setFormatter(formatter)
             logger.addHandler(file_handler)
@@ -26,4 +32,13 @@ def configure_logging(file_path=None, streaming=None, level=logging.INFO):
 
     return logger
 
-logger = configure_logging('logs/app.log', streaming=True)
\ No newline at end of file
+def append_log(logger=None):
+    '''
+    Makes the file handlers append to the log instead of truncating it, for processes sharing the log of a running app,
+    e.g. work queue workers. Only handlers which have not written anything yet are changed
+    '''
+    for handler in (logger or logging.getLogger()).handlers:
+        if isinstance(handler, logging.FileHandler) and handler.stream is None:
+            handler.mode = 'a'
+
+logger = configure_logging('logs/app.log', streaming=True)
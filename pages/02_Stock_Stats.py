@@ -1,6 +1,7 @@
 from modules.utils import logger
 from modules.YfScrapper import *
 from modules.Forecaster import *
+from modules.Screener import Screener
 import streamlit as st
 
 @st.cache_resource
@@ -14,6 +15,10 @@ def initialize(name: str):
         logger.info(f'{instance} initiated')
     return instance
 
+@st.cache_resource
+def load_screener():
+    return Screener.from_files()
+
 def main():
     st.set_page_config(page_title='Financial Analysis by Sien Long')
     scrapper = initialize('Scrapper')
@@ -33,5 +38,32 @@ def main():
                 df = scrapper.compile_dataframes().T
             st.dataframe(df, width=800, height=1000)
 
+    st.header('Screen S&P snapshots')
+    screener = load_screener()
+    with st.form("screen_form"):
+        date = st.selectbox('Snapshot', screener.dates[::-1])
+        metrics = screener.metrics(date)
+        filters = []
+        for i in range(3):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                metric = st.selectbox('Metric', ['None'] + metrics, key=f'metric_{i}')
+            with col2:
+                op = st.selectbox('Condition', ['<', '<=', '>', '>=', '==', '!='], key=f'op_{i}')
+            with col3:
+                value = st.number_input('Value', value=0.0, key=f'value_{i}')
+            if metric != 'None':
+                filters.append((metric, op, value))
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            rank_by = st.selectbox('Rank by', metrics, metrics.index('Market Cap (B)') if 'Market Cap (B)' in metrics else 0)
+        with col2:
+            ascending = st.checkbox('Ascending')
+        with col3:
+            top = st.number_input('Top', min_value=1, value=20)
+        screened = st.form_submit_button("Screen")
+    if screened:
+        st.dataframe(screener.screen(filters, rank_by=rank_by, ascending=ascending, top=int(top), date=date), width=800)
+
 if __name__ == '__main__':
     main()
\ No newline at end of file